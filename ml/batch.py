@@ -0,0 +1,286 @@
+import argparse
+import asyncio
+import glob
+import multiprocessing
+import os
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from pathlib import Path
+
+import ffmpeg
+import numpy as np
+import pandas as pd
+import torch
+
+from dataset import ResNetProcess, SignalProcess
+from model import CatBoost, DLModel
+from video import segment_stream
+
+VIDEO_SUFFIXES = (".mp4",)
+# columns and class names of the report the frontend exports, with the file added
+COLUMNS = ["Файл", "Время", "Тип аномалии", "Ссылка на артефакт", "Вероятность"]
+CLASS_NAMES = {
+    "blur": "Размытие",
+    "highlight": "Свет",
+    "crop": "Движение",
+    "overlap": "Перекрытие",
+}
+
+# report name, path, fps, first second and number of seconds
+Chunk = tuple[str, str, int, int, int]
+
+# model of a worker process, loaded once by init_worker
+_worker: dict = {}
+
+
+def collect_videos(source: str, tmp: str) -> list[tuple[str, str]]:
+    """
+    Find videos in a directory, a zip archive or by a glob pattern
+
+    Videos of an archive are extracted to `tmp`, ffmpeg needs seekable files.
+
+    Returns:
+        list[tuple[str, str]]: name for the report and path of every video
+    """
+    if os.path.isfile(source) and zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            names = sorted(
+                name
+                for name in archive.namelist()
+                if name.lower().endswith(VIDEO_SUFFIXES)
+                and not name.startswith("__MACOSX")
+            )
+            return [(name, archive.extract(name, tmp)) for name in names]
+
+    if os.path.isdir(source):
+        paths = sorted(
+            str(path)
+            for path in Path(source).rglob("*")
+            if path.suffix.lower() in VIDEO_SUFFIXES
+        )
+        return [(os.path.relpath(path, source), path) for path in paths]
+
+    paths = sorted(
+        path
+        for path in glob.glob(source, recursive=True)
+        if path.lower().endswith(VIDEO_SUFFIXES) and os.path.isfile(path)
+    )
+    return [(path, path) for path in paths]
+
+
+def probe_video(path: str) -> tuple[int, int]:
+    """
+    Returns:
+        tuple[int, int]: fps and number of seconds the service would analyse
+    """
+    probe = ffmpeg.probe(path)
+    video_info = next((s for s in probe["streams"] if s["codec_type"] == "video"), None)
+    if video_info is None:
+        raise ValueError("no video stream")
+    rate = Fraction(video_info["r_frame_rate"])
+    if "nb_frames" in video_info:
+        seconds = int(int(video_info["nb_frames"]) / rate)
+    else:
+        seconds = int(float(probe["format"]["duration"]))
+    return int(rate), max(seconds - 1, 0)
+
+
+def try_probe(path: str) -> tuple[int, int] | str:
+    """
+    Probe a video, the error message instead if it can not be read
+    """
+    try:
+        return probe_video(path)
+    except ffmpeg.Error as ex:
+        stderr = (ex.stderr or b"").decode(errors="replace").strip()
+        return stderr.splitlines()[-1] if stderr else str(ex)
+    except Exception as ex:
+        return str(ex) or repr(ex)
+
+
+def plan(
+    videos: list[tuple[str, str]], chunk_seconds: int
+) -> tuple[list[Chunk], list[tuple[str, str]]]:
+    """
+    Split every video into chunks of `chunk_seconds`, the longest videos first
+
+    Returns:
+        tuple: chunks, and name and error of every video that could not be probed
+    """
+    with ThreadPoolExecutor() as pool:
+        probes = list(pool.map(try_probe, [path for _, path in videos]))
+
+    failed = [
+        (name, probe)
+        for (name, _), probe in zip(videos, probes)
+        if isinstance(probe, str)
+    ]
+    probed = [
+        (video, probe)
+        for video, probe in zip(videos, probes)
+        if not isinstance(probe, str)
+    ]
+    chunks = []
+    for (name, path), (fps, seconds) in sorted(probed, key=lambda video: -video[1][1]):
+        for start in range(0, seconds, chunk_seconds):
+            chunks.append((name, path, fps, start, min(chunk_seconds, seconds - start)))
+    return chunks, failed
+
+
+def init_worker(
+    model_choice: str,
+    checkpoint: str,
+    variant: str,
+    calibration_dir: str | None,
+    threads: int,
+    batch_size: int,
+) -> None:
+    # every process runs one chunk at a time, more threads would fight for cores
+    torch.set_num_threads(threads)
+    if model_choice == "Bytes":
+        model = CatBoost()
+        model.load(checkpoint)
+        data_process = SignalProcess()
+    else:
+        model = DLModel(variant)
+        model.load(checkpoint)
+        data_process = ResNetProcess()
+        model.optimize(data_process.calibration_set(calibration_dir, 32), 0.98)
+    _worker.update(
+        model_choice=model_choice,
+        model=model,
+        data_process=data_process,
+        batch_size=batch_size,
+    )
+
+
+async def read_segments(
+    path: str, fps: int, start: int, duration: int
+) -> list[tuple[int, bytes]]:
+    return [segment async for segment in segment_stream(path, fps, duration, start)]
+
+
+def analyse_chunk(
+    chunk: Chunk,
+) -> tuple[Chunk, list[tuple[int, str, float]], str | None]:
+    """
+    Predict every second of a chunk in a worker process
+
+    Returns:
+        tuple: the chunk, second, label and probability of every second and error if any
+    """
+    name, path, fps, start, duration = chunk
+    model, data_process = _worker["model"], _worker["data_process"]
+    batch_size = _worker["batch_size"]
+    try:
+        segments = asyncio.run(read_segments(path, fps, start, duration))
+        predictions = []
+        for i in range(0, len(segments), batch_size):
+            batch = segments[i : i + batch_size]
+            if _worker["model_choice"] == "Bytes":
+                X = data_process.prepare_histograms(
+                    np.stack([data_process.byte_histogram(data) for _, data in batch])
+                )
+            else:
+                X = torch.cat(
+                    [data_process.prepare_from_bytes(data) for _, data in batch]
+                )
+            labels, probas = model.predict_with_proba(X)
+            predictions += [
+                (idx, str(label), float(proba))
+                for (idx, _), label, proba in zip(batch, labels, probas)
+            ]
+    except Exception as ex:
+        return chunk, [], str(ex)
+    return chunk, predictions, None
+
+
+def report_rows(name: str, predictions: list[tuple[int, str, float]]) -> list[dict]:
+    return [
+        {
+            "Файл": name,
+            "Время": f"{ts // 60}:{ts % 60:02d}",
+            "Тип аномалии": CLASS_NAMES.get(label, label),
+            "Ссылка на артефакт": "",
+            "Вероятность": proba,
+            "ts": ts,
+        }
+        for ts, label, proba in predictions
+        if label != "normal"
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Analyse a directory, glob or zip of videos without the service"
+    )
+    parser.add_argument("source", help="directory, zip archive or glob of videos")
+    parser.add_argument("--model", choices=["Rgb", "Bytes"], default="Rgb")
+    parser.add_argument("--output", default="report.csv", help=".csv or .parquet")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--chunk-seconds", type=int, default=60)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--variant", default=os.getenv("RGB_VARIANT", "fp32"))
+    parser.add_argument("--calibration-dir", default=os.getenv("RGB_CALIBRATION_DIR"))
+    parser.add_argument("--cb-checkpoint", default="./cb_checkpoint")
+    parser.add_argument("--resnet-checkpoint", default="./resnet_checkpoint")
+    args = parser.parse_args()
+
+    checkpoint = args.resnet_checkpoint if args.model == "Rgb" else args.cb_checkpoint
+    started = time.perf_counter()
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        videos = collect_videos(args.source, tmp)
+        chunks, failed = plan(videos, args.chunk_seconds)
+        for name, error in failed:
+            print(f"{name} can not be read: {error}")
+        seconds = sum(chunk[4] for chunk in chunks)
+        print(f"{len(videos)} videos, {seconds} seconds in {len(chunks)} chunks")
+
+        with multiprocessing.get_context("spawn").Pool(
+            args.workers,
+            initializer=init_worker,
+            initargs=(
+                args.model,
+                checkpoint,
+                args.variant,
+                args.calibration_dir,
+                args.threads_per_worker,
+                args.batch_size,
+            ),
+        ) as pool:
+            for done, (chunk, predictions, error) in enumerate(
+                pool.imap_unordered(analyse_chunk, chunks), 1
+            ):
+                name, _, _, start, duration = chunk
+                if error is not None:
+                    print(f"{name} {start}-{start + duration}s failed: {error}")
+                    failed.append((f"{name} {start}-{start + duration}s", error))
+                    continue
+                rows += report_rows(name, predictions)
+                print(f"{name} {start}-{start + duration}s done ({done}/{len(chunks)})")
+
+    report = pd.DataFrame(rows, columns=[*COLUMNS, "ts"])
+    report = report.sort_values(["Файл", "ts"]).drop(columns="ts")
+    if args.output.endswith(".parquet"):
+        report.to_parquet(args.output, index=False)
+    else:
+        report.to_csv(args.output, index=False)
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"{len(report)} anomalies written to {args.output}, "
+        f"{seconds / elapsed:.1f} seconds of video per second"
+    )
+    if failed:
+        for what, error in failed:
+            print(f"failed: {what}: {error}")
+        raise SystemExit(f"{len(failed)} videos or chunks failed")
+
+
+if __name__ == "__main__":
+    main()
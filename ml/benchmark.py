@@ -0,0 +1,358 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+import cv2
+import ffmpeg
+import numpy as np
+import torch
+
+from create_dataset import (
+    apply_specific_blur,
+    apply_specific_crop,
+    apply_specific_highlight,
+    apply_specific_overlap,
+    generate_noise_image,
+)
+from dataset import ResNetProcess, SignalProcess
+from model import CatBoost, DLModel
+from video import save_bin, segment_stream
+
+ANOMALIES = ["normal", "blur", "highlight", "crop", "overlap"]
+
+
+def synthetic_frame(idx: int, width: int, height: int) -> np.ndarray:
+    """
+    Moving gradient with a bouncing square, cheap to generate and not trivial to encode
+    """
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = (x + idx * 3) % 256
+    frame[..., 1] = (y + idx * 2) % 256
+    frame[..., 2] = (x[None] + y + idx) % 256
+
+    size = min(width, height) // 4
+    left = (idx * 7) % (width - size)
+    top = (idx * 5) % (height - size)
+    cv2.rectangle(frame, (left, top), (left + size, top + size), (255, 255, 255), -1)
+    return frame
+
+
+def make_video(
+    path: str, width: int, height: int, fps: int, seconds: int, seed: int = 0
+) -> list[str]:
+    """
+    Write deterministic synthetic video, every second has one anomaly type in turn
+
+    Returns:
+        list[str]: label of every second
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    noise = generate_noise_image((height, width, 3))
+
+    process = (
+        ffmpeg.input(
+            "pipe:", format="rawvideo", pix_fmt="bgr24", s=f"{width}x{height}", r=fps
+        )
+        .output(path, vcodec="libx264", pix_fmt="yuv420p", g=fps, loglevel="error")
+        .overwrite_output()
+        .run_async(pipe_stdin=True)
+    )
+    labels = []
+    for second in range(seconds):
+        label = ANOMALIES[second % len(ANOMALIES)]
+        labels.append(label)
+        for i in range(fps):
+            frame = synthetic_frame(second * fps + i, width, height)
+            if label == "blur":
+                frame = apply_specific_blur(frame, blur_intensity=25)
+            elif label == "highlight":
+                frame = apply_specific_highlight(frame, highlight_intensity=25)
+            elif label == "crop":
+                frame = apply_specific_crop(
+                    frame, width // 2, height // 2, width // 4, height // 4
+                )
+            elif label == "overlap":
+                frame = apply_specific_overlap(
+                    frame, width // 4, width // 2, height // 2, noise
+                )
+            process.stdin.write(frame.tobytes())
+    process.stdin.close()
+    process.wait()
+    return labels
+
+
+def measure(fn: Callable[[], object], repeat: int) -> list[float]:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def summary(stage: str, times: list[float], frames: int, **params) -> dict:
+    ms = np.array(times) * 1000
+    return {
+        "stage": stage,
+        **params,
+        "n": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "per_frame_ms": float(ms.mean() / frames),
+    }
+
+
+def load_models(
+    cb_checkpoint: str, resnet_checkpoint: str, variant: str, optimize: bool = True
+) -> tuple[CatBoost, DLModel]:
+    cb_model = CatBoost()
+    cb_model.load(cb_checkpoint)
+
+    resnet_model = DLModel(variant)
+    if (Path(resnet_checkpoint) / "model.pt").exists():
+        resnet_model.load(resnet_checkpoint)
+    else:
+        # timings do not depend on the weights
+        print("resnet weights not found, using random weights")
+        resnet_model.le.fit(cb_model.classes)
+    if not optimize:
+        return cb_model, resnet_model
+    # random inputs and no accuracy check, only speed matters here
+    resnet_model.optimize(torch.randn(8, 2, 3, 224, 224), 0.0)
+    resnet_model.warmup([1, 8])
+    return cb_model, resnet_model
+
+
+def bench_video(
+    video: str,
+    params: dict,
+    fps: int,
+    seconds: int,
+    cb_model: CatBoost,
+    resnet_model: DLModel,
+    batch_size: int,
+    repeat: int,
+) -> list[dict]:
+    results = []
+    signal_process = SignalProcess()
+    resnet_process = ResNetProcess()
+
+    with tempfile.TemporaryDirectory() as out:
+        save_times = [
+            measure(lambda: save_bin(video, out, idx, fps), 1)[0]
+            for idx in range(seconds)
+        ]
+        results.append(summary("save_bin", save_times, fps, **params))
+        bins = [f"{out}/frame-{idx}.bin" for idx in range(seconds)]
+
+        async def segments():
+            return [data async for _, data in segment_stream(video, fps, seconds)]
+
+        started = time.perf_counter()
+        segment_data = asyncio.run(segments())
+        elapsed = time.perf_counter() - started
+        results.append(
+            summary("segment_stream", [elapsed / len(segment_data)], fps, **params)
+        )
+
+        signal_times, resnet_times, cb_times, dl_times = [], [], [], []
+        for path in bins:
+            signal_times += measure(
+                lambda: signal_process.prepare_from_bin(path), repeat
+            )
+            resnet_times += measure(
+                lambda: resnet_process.prepare_from_bin(path), repeat
+            )
+            features = signal_process.prepare_from_bin(path)
+            X = resnet_process.prepare_from_bin(path)
+            cb_times += measure(lambda: cb_model.predict(features), repeat)
+            dl_times += measure(lambda: resnet_model.predict(X), repeat)
+        results.append(
+            summary("SignalProcess.prepare_from_bin", signal_times, fps, **params)
+        )
+        results.append(
+            summary("ResNetProcess.prepare_from_bin", resnet_times, fps, **params)
+        )
+        results.append(summary("CatBoost.predict", cb_times, fps, **params))
+        results.append(summary("DLModel.predict", dl_times, fps, **params))
+
+        # batched inference as the service runs it
+        histograms = np.stack(
+            [signal_process.byte_histogram(data) for data in segment_data]
+        )
+        cb_batch = measure(
+            lambda: cb_model.predict_with_proba(
+                signal_process.prepare_histograms(histograms[:batch_size])
+            ),
+            repeat,
+        )
+        n = min(batch_size, len(histograms))
+        results.append(
+            summary(
+                "CatBoost.predict_with_proba",
+                [t / n for t in cb_batch],
+                fps,
+                batch=n,
+                **params,
+            )
+        )
+        X = torch.cat(
+            [
+                resnet_process.prepare_from_bytes(data)
+                for data in segment_data[:batch_size]
+            ]
+        )
+        dl_batch = measure(lambda: resnet_model.predict_with_proba(X), repeat)
+        results.append(
+            summary(
+                "DLModel.predict_with_proba",
+                [t / len(X) for t in dl_batch],
+                fps,
+                batch=len(X),
+                **params,
+            )
+        )
+
+        # end to end per second: legacy bin files and in-memory segments
+        e2e = {"bytes_bin": [], "rgb_bin": [], "bytes_stream": [], "rgb_stream": []}
+        for idx in range(seconds):
+            e2e["bytes_bin"] += measure(
+                lambda: cb_model.predict(
+                    signal_process.prepare_from_bin(save_bin(video, out, idx, fps))
+                ),
+                1,
+            )
+            e2e["rgb_bin"] += measure(
+                lambda: resnet_model.predict(
+                    resnet_process.prepare_from_bin(save_bin(video, out, idx, fps))
+                ),
+                1,
+            )
+        for data in segment_data:
+            e2e["bytes_stream"] += measure(
+                lambda: cb_model.predict(
+                    signal_process.prepare_histograms(
+                        signal_process.byte_histogram(data)[None]
+                    )
+                ),
+                1,
+            )
+            e2e["rgb_stream"] += measure(
+                lambda: resnet_model.predict(resnet_process.prepare_from_bytes(data)), 1
+            )
+        stream_share = elapsed / len(segment_data)
+        for name, times in e2e.items():
+            if name.endswith("stream"):
+                times = [t + stream_share for t in times]
+            results.append(summary(f"end_to_end.{name}", times, fps, **params))
+
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path: str, results: list[dict]) -> None:
+    """
+    Print change of mean time of every stage against earlier results
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+
+    def key(result: dict) -> tuple:
+        return tuple(
+            (k, v) for k, v in result.items() if not k.endswith("_ms") and k != "n"
+        )
+
+    baseline = {key(result): result for result in old["results"]}
+    for result in results:
+        before = baseline.get(key(result))
+        if before is None:
+            continue
+        change = result["mean_ms"] / before["mean_ms"] - 1
+        print(
+            f"{result['stage']:32} {result['resolution']:>10} {result['fps']:>3}fps "
+            f"{before['mean_ms']:9.2f} -> {result['mean_ms']:9.2f} ms ({change:+.1%})"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time every stage of the pipeline")
+    parser.add_argument("--resolutions", default="640x360,1280x720,1920x1080")
+    parser.add_argument("--fps", default="25,30")
+    parser.add_argument("--seconds", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--variant", default=os.getenv("RGB_VARIANT", "fp32"))
+    parser.add_argument("--cb-checkpoint", default="./cb_checkpoint")
+    parser.add_argument("--resnet-checkpoint", default="./resnet_checkpoint")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="earlier results to compare with")
+    args = parser.parse_args()
+
+    cb_model, resnet_model = load_models(
+        args.cb_checkpoint, args.resnet_checkpoint, args.variant
+    )
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for resolution in args.resolutions.split(","):
+            width, height = map(int, resolution.split("x"))
+            for fps in map(int, args.fps.split(",")):
+                video = f"{tmp}/{resolution}_{fps}.mp4"
+                make_video(video, width, height, fps, args.seconds + 1)
+                print(f"benchmarking {resolution} at {fps} fps")
+                results += bench_video(
+                    video,
+                    {"resolution": resolution, "fps": fps},
+                    fps,
+                    args.seconds,
+                    cb_model,
+                    resnet_model,
+                    args.batch_size,
+                    args.repeat,
+                )
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+            "cpu": platform.processor() or platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "variant": resnet_model.variant,
+            "seconds": args.seconds,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
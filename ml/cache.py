@@ -0,0 +1,83 @@
+import hashlib
+import os
+import pickle
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+
+def checkpoint_id(dir: str, *extra: str) -> str:
+    """
+    Identify model by the content of its checkpoint and inference options
+    """
+    digest = hashlib.sha256()
+    for path in sorted(Path(dir).rglob("*")):
+        if path.is_file():
+            digest.update(path.name.encode())
+            digest.update(path.read_bytes())
+    for option in extra:
+        digest.update(option.encode())
+    return digest.hexdigest()[:16]
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class DiskCache:
+    """
+    Size-bounded LRU of pickled values on local disk
+
+    Entries are files named by key, recency survives restarts through file
+    modification time. Safe to use from several threads.
+    """
+
+    def __init__(self, dir: str, max_bytes: int) -> None:
+        self._dir = Path(dir)
+        self._dir.mkdir(parents=True, exist_ok=True)
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        for path in sorted(self._dir.glob("*.pkl"), key=lambda p: p.stat().st_mtime):
+            self._entries[path.stem] = path.stat().st_size
+        self._size = sum(self._entries.values())
+        for tmp in self._dir.glob("*.tmp"):
+            tmp.unlink(missing_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self._dir / f"{key}.pkl"
+
+    def get(self, key: str) -> Any | None:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return pickle.loads(data)
+
+    def put(self, key: str, value: Any) -> None:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self._max_bytes:
+            return
+
+        path = self._path(key)
+        tmp = self._dir / f"{key}.{uuid.uuid4().hex}.tmp"
+        tmp.write_bytes(data)
+
+        # files appear and disappear under the lock only, so an eviction never
+        # deletes the file of a concurrent put of the same key
+        with self._lock:
+            os.replace(tmp, path)
+            self._size += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            while self._size > self._max_bytes:
+                old, size = self._entries.popitem(last=False)
+                self._size -= size
+                self._path(old).unlink(missing_ok=True)
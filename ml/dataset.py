@@ -1,21 +1,25 @@
 import abc
-import os
+from io import BytesIO
 from pathlib import Path
 
+import av
 import cv2
 import torch
 import numpy as np
 import pandas as pd
-import scipy.stats as stats
-from scipy.signal import medfilt
+from scipy import ndimage
 from torchvision import transforms
 
 
 class DataProcess(abc.ABC):
     @abc.abstractmethod
-    def prepare_from_bin(self, bin_path: str) -> pd.DataFrame | torch.Tensor:
+    def prepare_from_bytes(self, data: bytes) -> pd.DataFrame | torch.Tensor:
         pass
 
+    def prepare_from_bin(self, bin_path: str) -> pd.DataFrame | torch.Tensor:
+        with open(bin_path, "rb") as f:
+            return self.prepare_from_bytes(f.read())
+
 
 class ResNetProcess(DataProcess):
     def __init__(self) -> None:
@@ -29,44 +33,55 @@ class ResNetProcess(DataProcess):
             ]
         )
 
-    def prepare_from_bin(self, bin_path: str) -> torch.Tensor:
-        path = bin_path
-        target_path = path.replace("bin", "h264")
-
-        # Копирование файла с изменением формата
-        if not Path(target_path).exists():
-            with open(path, "rb") as f:
-                data = f.read()
-                with open(target_path, "wb") as f:
-
-                    f.write(data)
-
-        # Чтение видео
-        video = cv2.VideoCapture(target_path)
+    def prepare_from_bytes(self, data: bytes) -> torch.Tensor:
+        # Декодирование h264 прямо из памяти
         seq = []
-        cnt = 0
-        while cnt < 2:
-            ret, frame = video.read()
-            if not ret:
-                break
-
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)  # Преобразование в RGB
-            frame = cv2.resize(frame, (384, 384), interpolation=cv2.INTER_AREA)
-            if self.transform:
-                frame = self.transform(frame)
-            else:
-                frame = torch.from_numpy(frame)
-            seq.append(frame)
-            cnt += 1
-
-        video.release()
-        os.remove(target_path)  # Удаление временного файла
+        with av.open(BytesIO(data), format="h264") as container:
+            for frame in container.decode(video=0):
+                frame = frame.to_ndarray(format="rgb24")
+                frame = cv2.resize(frame, (384, 384), interpolation=cv2.INTER_AREA)
+                if self.transform:
+                    frame = self.transform(frame)
+                else:
+                    frame = torch.from_numpy(frame)
+                seq.append(frame)
+                if len(seq) == 2:
+                    break
 
         seq = torch.stack(seq, dim=0)
         return seq[None]
 
+    def calibration_set(self, dir: str | None, size: int) -> torch.Tensor | None:
+        """
+        Sample inputs for quantization and accuracy checks of optimised models
+
+        Segments saved with `save_bin` are read from `dir`. None if there are
+        none, random inputs would only hide a variant that is not accurate.
+        """
+        paths = sorted(Path(dir).glob("*.bin"))[:size] if dir else []
+        if not paths:
+            return None
+        return torch.cat([self.prepare_from_bin(path) for path in paths])
+
 
 class SignalProcess(DataProcess):
+    FEATURES = [
+        "min_t",
+        "max_t",
+        "mean_t",
+        "rms_t",
+        "var_t",
+        "std_t",
+        "power_t",
+        "peak_t",
+        "p2p_t",
+        "crest_factor_t",
+        "skew_t",
+        "kurtosis_t",
+        "form_factor_t",
+        "pulse_indicator_t",
+    ]
+
     def __init__(
         self,
         denoize: bool = False,
@@ -75,103 +90,101 @@ class SignalProcess(DataProcess):
         self._denoize = denoize
         self._median_filter = median_filter
 
-    # Time and frequency domains
-    @staticmethod
-    def rms(y: np.ndarray):
-        return np.sqrt(np.mean(y**2))
-
-    @staticmethod
-    def power(y: np.ndarray):
-        return np.mean(y**2)
-
-    @staticmethod
-    def peak(y: np.ndarray):
-        return np.max(np.abs(y))
-
     @staticmethod
-    def p2p(y: np.ndarray):
-        return np.ptp(y)
+    def byte_histogram(data: bytes) -> np.ndarray:
+        return np.bincount(np.frombuffer(data, dtype="uint8"), minlength=256)
 
     @staticmethod
-    def crest_factor(y: np.ndarray):
-        return np.max(np.abs(y)) / np.sqrt(np.mean(y**2))
+    def median_filter_batch(raw_data: np.ndarray) -> np.ndarray:
+        # то же, что medfilt(kernel_size=35) для каждой строки
+        return ndimage.median_filter(raw_data, size=(1, 35), mode="constant")
 
     @staticmethod
-    def skew(y: np.ndarray):
-        return stats.skew(y, nan_policy="omit")
+    def denoize_mask(raw_data: np.ndarray, threshold: float = 0.05) -> np.ndarray:
+        max_val = np.abs(raw_data).max(axis=1, keepdims=True)
+        return np.abs(raw_data) > threshold * max_val
 
     @staticmethod
-    def kurtosis(y: np.ndarray):
-        return stats.kurtosis(y)
-
-    @staticmethod
-    def form_factor(y: np.ndarray):
-        return np.sqrt(np.mean(y**2)) / np.mean(y)
+    def to_frame(features: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame(features, columns=SignalProcess.FEATURES)
+
+    def prepare_batch(
+        self, raw_data: np.ndarray, mask: np.ndarray | None = None
+    ) -> np.ndarray:
+        """
+        Compute features for a batch of signals in a few vectorized passes
+
+        Args:
+            raw_data (np.ndarray): [N, L] signals, e.g. byte histograms
+            mask (np.ndarray | None): [N, L] values to take into account, all if None
+
+        Returns:
+            np.ndarray: contiguous float32 [N, len(FEATURES)] matrix
+        """
+        assert raw_data.ndim == 2
 
-    @staticmethod
-    def pulse_indicator(y: np.ndarray):
-        return np.max(np.abs(y)) / np.mean(y)
+        raw_data = raw_data.astype(np.float64)
+        if mask is None:
+            mask = np.ones(raw_data.shape, dtype=bool)
 
-    @staticmethod
-    def denoize(dataset: np.ndarray, threshold: float = 0.05) -> np.ndarray:
-        cleaned_dataset = dataset.copy()
-        for i in range(len(dataset)):
-            max_val = np.max(np.abs(dataset[i, 0]))
-            silence_mask = np.abs(dataset[i, 0]) > threshold * max_val
-            cleaned_dataset[i, 0] = dataset[i, 0][silence_mask]
-        return cleaned_dataset
+        if self._median_filter:
+            raw_data = self.median_filter_batch(raw_data)
 
-    @staticmethod
-    def median_filter(dataset: np.ndarray) -> np.ndarray:
-        cleaned_dataset = dataset.copy()
-        for i in range(len(dataset)):
-            cleaned_dataset[i, 0] = medfilt(dataset[i, 0], kernel_size=35)
-        return cleaned_dataset
+        if self._denoize:
+            mask = mask & self.denoize_mask(np.where(mask, raw_data, 0))
+
+        n = mask.sum(axis=1)
+        y = np.where(mask, raw_data, 0)
+        abs_y = np.abs(y)
+        y2 = y * y
+
+        min_t = np.where(mask, raw_data, np.inf).min(axis=1)
+        max_t = np.where(mask, raw_data, -np.inf).max(axis=1)
+        mean_t = y.sum(axis=1) / n
+        power_t = y2.sum(axis=1) / n
+        rms_t = np.sqrt(power_t)
+        peak_t = abs_y.max(axis=1)
+
+        d = np.where(mask, raw_data - mean_t[:, None], 0)
+        d2 = d * d
+        var_t = d2.sum(axis=1) / n
+        m3 = (d2 * d).sum(axis=1) / n
+        m4 = (d2 * d2).sum(axis=1) / n
+
+        # как в scipy.stats: для постоянного сигнала skew и kurtosis не определены
+        eps = np.finfo(var_t.dtype).resolution * 10
+        zero = var_t <= (eps * mean_t) ** 2
+        with np.errstate(all="ignore"):
+            skew_t = np.where(zero, np.nan, m3 / var_t**1.5)
+            kurtosis_t = np.where(zero, np.nan, m4 / var_t**2 - 3)
+
+        features = np.stack(
+            [
+                min_t,
+                max_t,
+                mean_t,
+                rms_t,
+                var_t,
+                np.sqrt(var_t),
+                power_t,
+                peak_t,
+                max_t - min_t,
+                peak_t / rms_t,
+                skew_t,
+                kurtosis_t,
+                rms_t / mean_t,
+                peak_t / mean_t,
+            ],
+            axis=1,
+        )
+        return np.ascontiguousarray(features, dtype=np.float32)
 
-    def prepare_from_bin(self, bin_path: str) -> pd.DataFrame:
-        data = pd.Series(np.fromfile(bin_path, dtype="uint8"))
-        raw_data = data.value_counts().sort_index().values[None]
+    def prepare_histograms(self, histograms: np.ndarray) -> np.ndarray:
+        # value_counts не учитывает значения байтов, которых нет в сегменте
+        return self.prepare_batch(histograms, histograms > 0)
 
-        return self.prepare_data(raw_data)
+    def prepare_from_bytes(self, data: bytes) -> pd.DataFrame:
+        return self.to_frame(self.prepare_histograms(self.byte_histogram(data)[None]))
 
     def prepare_data(self, raw_data: np.ndarray) -> pd.DataFrame:
-        assert raw_data.ndim == 2
-
-        if self._median_filter:
-            raw_data = self.median_filter(raw_data)
-
-        if self._denoize:
-            raw_data = self.denoize(raw_data)
-
-        df = pd.DataFrame()
-        df["min_t"] = [np.min(y) for y in raw_data[:]]
-        df["max_t"] = [np.max(y) for y in raw_data[:]]
-        df["mean_t"] = [np.mean(y) for y in raw_data[:]]
-        df["rms_t"] = [SignalProcess.rms(y) for y in raw_data[:]]
-        df["var_t"] = [np.var(y) for y in raw_data[:]]
-        df["std_t"] = [np.std(y) for y in raw_data[:]]
-        df["power_t"] = [SignalProcess.power(y) for y in raw_data[:]]
-        df["peak_t"] = [SignalProcess.peak(y) for y in raw_data[:]]
-        df["p2p_t"] = [SignalProcess.p2p(y) for y in raw_data[:]]
-        df["crest_factor_t"] = [SignalProcess.crest_factor(y) for y in raw_data[:]]
-        df["skew_t"] = [SignalProcess.skew(y) for y in raw_data[:]]
-        df["kurtosis_t"] = [SignalProcess.kurtosis(y) for y in raw_data[:]]
-        df["form_factor_t"] = [SignalProcess.form_factor(y) for y in raw_data[:]]
-        df["pulse_indicator_t"] = [
-            SignalProcess.pulse_indicator(y) for y in raw_data[:]
-        ]
-
-        # fft_data = [fft(y) for y in raw_data[:, 0]]
-        # fft_data = [np.abs(y ** 2) / len(y) for y in raw_data[:, 0]]
-
-        # df["max_f"] = [np.max(y) for y in fft_data]
-        # df["sum_f"] = [np.sum(y) for y in fft_data]
-        # df["mean_f"] = [np.mean(y) for y in fft_data]
-        # df["var_f"] = [np.var(y) for y in fft_data]
-        # df["peak_f"] = [SignalProcess.peak(y) for y in fft_data]
-        # df["skew_f"] = [SignalProcess.skew(y) for y in fft_data]
-        # df["kurtosis_f"] = [SignalProcess.kurtosis(y) for y in fft_data]
-
-        # df["target"] = raw_data[:, 1]
-
-        return df
+        return self.to_frame(self.prepare_batch(raw_data))
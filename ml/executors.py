@@ -0,0 +1,73 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterator, TypeVar
+
+from profiling import current_profile
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_DONE = object()
+
+# Network and subprocess calls mostly wait, so the pool is wide
+IO_WORKERS = int(os.getenv("IO_WORKERS", 4 * (os.cpu_count() or 1)))
+# torch, OpenCV, PyAV and CatBoost release the GIL and parallelize internally,
+# a few threads are enough to keep every core busy
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", 2))
+
+io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+cpu_pool = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+
+
+async def _run_in_thread(
+    pool: ThreadPoolExecutor, fn: Callable[..., R], *args, **kwargs
+) -> R:
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    if (profile := current_profile()) is not None:
+        name = getattr(fn, "__qualname__", repr(fn))
+        fn, args = profile.call, (name, fn, *args)
+    call = functools.partial(ctx.run, fn, *args, **kwargs)
+    return await loop.run_in_executor(pool, call)
+
+
+async def run_io(fn: Callable[..., R], *args, **kwargs) -> R:
+    """
+    Run blocking I/O call (network, subprocess, database) in the I/O thread pool
+    """
+    return await _run_in_thread(io_pool, fn, *args, **kwargs)
+
+
+async def run_cpu(fn: Callable[..., R], *args, **kwargs) -> R:
+    """
+    Run CPU-bound call that releases the GIL (decoding, inference) in the CPU thread pool
+    """
+    return await _run_in_thread(cpu_pool, fn, *args, **kwargs)
+
+
+async def iterate_io(iterator: Iterator[T]) -> AsyncIterator[T]:
+    """
+    Iterate blocking iterator in a dedicated thread, one item at a time
+
+    Steps and the final close of the iterator run in the same thread, so the
+    iterator is never touched concurrently even if the consumer is cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="io-iter")
+    try:
+        while (
+            item := await loop.run_in_executor(pool, next, iterator, _DONE)
+        ) is not _DONE:
+            yield item
+    finally:
+        if hasattr(iterator, "close"):
+            pool.submit(iterator.close)
+        pool.shutdown(wait=False)
+
+
+def shutdown() -> None:
+    io_pool.shutdown(wait=False, cancel_futures=True)
+    cpu_pool.shutdown(wait=False, cancel_futures=True)
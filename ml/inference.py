@@ -0,0 +1,171 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import torch
+import torch.multiprocessing
+from sklearn.preprocessing import LabelEncoder
+
+from dataset import SignalProcess
+from metrics import INFERENCE_RESTARTS
+from model import CatBoost, DLModel
+
+# models of a worker process, set by _init_worker
+_worker: dict = {}
+
+
+def _init_worker(
+    state: dict[str, torch.Tensor],
+    le: LabelEncoder,
+    variant: str,
+    model_bytes: CatBoost,
+    threads: int,
+    calibration: torch.Tensor | None,
+    min_agreement: float,
+    warmup_batches: list[int],
+    ready,
+) -> None:
+    torch.set_num_threads(threads)
+    model_rgb = DLModel(variant)
+    model_rgb.load_shared(state, le)
+    model_rgb.optimize(calibration, min_agreement)
+    model_rgb.warmup(warmup_batches)
+    _worker.update(
+        Rgb=model_rgb,
+        Bytes=model_bytes,
+        data_process_bytes=SignalProcess(),
+        ready=ready,
+    )
+
+
+def _ready() -> tuple[int, str]:
+    # every worker blocks here until all of them are started
+    _worker["ready"].wait()
+    return os.getpid(), _worker["Rgb"].variant
+
+
+def _predict(
+    model_choice: str, X: np.ndarray | torch.Tensor
+) -> tuple[np.ndarray, np.ndarray]:
+    if model_choice == "Bytes":
+        X = _worker["data_process_bytes"].prepare_histograms(X)
+    return _worker[model_choice].predict_with_proba(X)
+
+
+class InferencePool:
+    """
+    Inference in worker processes that share the ResNet weights
+
+    The fp32 weights are moved to shared memory once and every worker maps them
+    instead of loading the checkpoint, then builds the configured variant on
+    top. dynamic_int8 and compiled keep using the shared backbone, variants that
+    rewrite convolution weights (static_int8, channels_last, traced) keep a
+    private copy per worker. Batches are passed to workers in shared memory as
+    well. CatBoost is small and is copied to every worker.
+
+    If a worker dies, e.g. killed for memory, the pool is rebuilt from the same
+    shared weights and the batch is sent once more.
+
+    Args:
+        model_rgb (DLModel): fp32 model, not optimized
+        model_bytes (CatBoost): bytes model
+        variant (str): DLModel variant built by every worker
+        processes (int): number of worker processes
+        threads (int): torch threads of every worker
+        calibration (torch.Tensor | None): inputs to check the variant against fp32
+        min_agreement (float): minimum agreement of the variant with fp32
+        warmup_batches (list[int]): batch sizes to run once at start
+    """
+
+    def __init__(
+        self,
+        model_rgb: DLModel,
+        model_bytes: CatBoost,
+        variant: str,
+        processes: int,
+        threads: int,
+        calibration: torch.Tensor | None,
+        min_agreement: float,
+        warmup_batches: list[int],
+    ) -> None:
+        # torch.multiprocessing pickles tensors as handles to shared memory
+        self._context = torch.multiprocessing.get_context("spawn")
+        self._processes = processes
+        # the parent keeps the shared tensors alive for pools built later
+        self._initargs = (
+            model_rgb.share_memory(),
+            model_rgb.le,
+            variant,
+            model_bytes,
+            threads,
+            calibration.share_memory_() if calibration is not None else None,
+            min_agreement,
+            warmup_batches,
+        )
+        self._restarting = asyncio.Lock()
+        self._pool = self._create_pool()
+        # variant the workers built and their pids, known once they are started
+        self.variant: str | None = None
+        self.pids: list[int] = []
+
+    def _create_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self._processes,
+            mp_context=self._context,
+            initializer=_init_worker,
+            initargs=(*self._initargs, self._context.Barrier(self._processes)),
+        )
+
+    async def start(self) -> None:
+        """
+        Start every worker and wait until its models are ready
+
+        Raises:
+            RuntimeError: workers kept different variants, e.g. some of them
+            fell back to fp32
+        """
+        loop = asyncio.get_running_loop()
+        workers = await asyncio.gather(
+            *(loop.run_in_executor(self._pool, _ready) for _ in range(self._processes))
+        )
+        variants = {variant for _, variant in workers}
+        if len(variants) > 1:
+            raise RuntimeError(f"inference workers built different variants: {workers}")
+        self.variant = variants.pop()
+        self.pids = sorted(pid for pid, _ in workers)
+        print(f"inference workers ready: {self.pids}")
+
+    async def _restart(self, broken: ProcessPoolExecutor) -> None:
+        async with self._restarting:
+            # batches that failed together rebuild the pool once
+            if self._pool is not broken:
+                return
+            INFERENCE_RESTARTS.inc()
+            print("inference worker died, restarting the pool")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._create_pool()
+            await self.start()
+
+    async def predict(
+        self, model_choice: str, X: np.ndarray | torch.Tensor
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Labels and probabilities of a batch: Rgb frame pairs or Bytes histograms
+
+        Raises:
+            BrokenProcessPool: the batch killed a rebuilt pool as well
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            pool = self._pool
+            try:
+                return await loop.run_in_executor(pool, _predict, model_choice, X)
+            except BrokenProcessPool:
+                await self._restart(pool)
+                if attempt:
+                    raise
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
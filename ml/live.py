@@ -0,0 +1,136 @@
+import asyncio
+import math
+from collections import deque
+from contextlib import aclosing, suppress
+from typing import AsyncIterator, TypeVar
+
+from metrics import LIVE_DROPPED, LIVE_LAG
+
+T = TypeVar("T")
+
+
+class LagStats:
+    """
+    Lag of live processing: time from the arrival of a window to the end of the pipeline
+
+    Windows older than `max_age` seconds are late: every stage asks before doing
+    its work and drops them instead of reporting them late.
+    """
+
+    def __init__(self, max_age: float = math.inf, report_every: int = 10) -> None:
+        self.max_age = max_age
+        self._report_every = report_every
+        self._arrivals: dict[int, float] = {}
+        self.received = 0
+        self.dropped = 0
+        self.processed = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def arrived(self, idx: int) -> None:
+        self.received += 1
+        self._arrivals[idx] = asyncio.get_running_loop().time()
+
+    def drop(self, idx: int, reason: str = "late") -> None:
+        self.dropped += 1
+        self._arrivals.pop(idx, None)
+        LIVE_DROPPED.labels(reason).inc()
+
+    def on_time(self, idx: int) -> bool:
+        """
+        Drop the window if it is older than `max_age`, windows not seen are on time
+        """
+        arrived = self._arrivals.get(idx)
+        if (
+            arrived is None
+            or asyncio.get_running_loop().time() - arrived <= self.max_age
+        ):
+            return True
+
+        self.drop(idx)
+        return False
+
+    def fresh(self, items: list[tuple[int, ...]]) -> list[tuple[int, ...]]:
+        """
+        Windows of a batch that are still on time
+        """
+        return [item for item in items if self.on_time(item[0])]
+
+    def done(self, idx: int) -> None:
+        arrived = self._arrivals.pop(idx, None)
+        if arrived is None:
+            return
+
+        self.processed += 1
+        self.last_lag = asyncio.get_running_loop().time() - arrived
+        self.max_lag = max(self.max_lag, self.last_lag)
+        LIVE_LAG.observe(self.last_lag)
+        if self.processed % self._report_every == 0:
+            print(self)
+
+    def __str__(self) -> str:
+        return (
+            f"lag {self.last_lag:.2f}s (max {self.max_lag:.2f}s), "
+            f"processed {self.processed}, dropped {self.dropped} of {self.received}"
+        )
+
+
+async def drop_stale(
+    segments: AsyncIterator[tuple[int, T]],
+    max_pending: int,
+    stats: LagStats,
+) -> AsyncIterator[tuple[int, T]]:
+    """
+    Keep live segments flowing when the consumer can't keep up
+
+    Segments are read from the source as soon as they arrive, so the source never
+    stalls. At most `max_pending` segments wait for the consumer, the oldest is
+    dropped when a new one arrives, and segments older than `stats.max_age`
+    seconds are skipped. Later stages should check `stats.on_time` again, as
+    segments keep aging in their queues.
+
+    Args:
+        segments (AsyncIterator[tuple[int, T]]): live segments with second index
+        max_pending (int): maximum number of segments waiting for the consumer
+        stats (LagStats): lag statistics to update
+
+    Yields:
+        tuple[int, T]: fresh segments
+    """
+    pending: deque[tuple[int, T]] = deque()
+    ready = asyncio.Event()
+
+    async def read():
+        try:
+            async with aclosing(segments):
+                async for segment in segments:
+                    stats.arrived(segment[0])
+                    if len(pending) >= max_pending:
+                        idx, _ = pending.popleft()
+                        stats.drop(idx, "overflow")
+                    pending.append(segment)
+                    ready.set()
+        finally:
+            ready.set()
+
+    reader = asyncio.create_task(read())
+    try:
+        while True:
+            if not pending:
+                if reader.done():
+                    break
+                ready.clear()
+                await ready.wait()
+                continue
+
+            segment = pending.popleft()
+            if not stats.on_time(segment[0]):
+                continue
+
+            yield segment
+
+        await reader
+    finally:
+        reader.cancel()
+        with suppress(asyncio.CancelledError):
+            await reader
@@ -0,0 +1,476 @@
+import argparse
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import platform
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent import futures
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+import grpc
+import numpy as np
+import pymongo
+import torch
+
+# main.py builds its S3 and Mongo clients at import, they are never used here
+os.environ.setdefault("S3_HOST", "localhost:9000")
+os.environ.setdefault("MONGO_HOST", "localhost")
+os.environ.setdefault("MONGO_PORT", "27017")
+os.environ.setdefault("MONGO_DB", "loadtest")
+
+import executors  # noqa: E402
+import pb.detection_pb2_grpc  # noqa: E402
+from benchmark import git_commit, load_models, make_video  # noqa: E402
+from cache import checkpoint_id  # noqa: E402
+from dataset import ResNetProcess, SignalProcess  # noqa: E402
+from inference import InferencePool  # noqa: E402
+from main import MlService  # noqa: E402
+from message import HEADER, MAGIC  # noqa: E402
+from pb.detection_pb2 import Model as ModelChoice  # noqa: E402
+from pb.detection_pb2 import Query, ResponseStatus, ResultReq  # noqa: E402
+from results import ResultCache  # noqa: E402
+
+
+class LocalObjectStore:
+    """
+    Filesystem stand-in for the Minio calls of the ml service
+
+    Objects are files in `root/bucket/name`, presigned urls are plain paths.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = Path(root)
+
+    def put(self, bucket: str, name: str, src: str) -> None:
+        path = self.root / bucket / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(src, path)
+
+    def stat_object(self, bucket: str, name: str) -> SimpleNamespace:
+        path = self.root / bucket / name
+        with open(path, "rb") as f:
+            etag = hashlib.file_digest(f, "md5").hexdigest()
+        return SimpleNamespace(etag=etag, size=path.stat().st_size)
+
+    def presigned_get_object(self, bucket: str, name: str) -> str:
+        return str(self.root / bucket / name)
+
+
+class MemoryCursor:
+    def __init__(self, docs: list[dict]) -> None:
+        self._docs = docs
+
+    def sort(self, key: str, direction: int = pymongo.ASCENDING) -> "MemoryCursor":
+        self._docs.sort(
+            key=lambda doc: doc[key], reverse=direction == pymongo.DESCENDING
+        )
+        return self
+
+    def batch_size(self, size: int) -> "MemoryCursor":
+        return self
+
+    def __iter__(self):
+        return iter(self._docs)
+
+    def __enter__(self) -> "MemoryCursor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+class MemoryCollection:
+    """
+    In-memory stand-in for the pymongo collection calls of the ml service
+
+    Filters match fields by equality, indexes are accepted and ignored.
+    """
+
+    def __init__(self) -> None:
+        self._docs: list[dict] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _matches(doc: dict, filter: dict | None) -> bool:
+        return all(doc.get(key) == value for key, value in (filter or {}).items())
+
+    @staticmethod
+    def _project(doc: dict, projection: dict | None) -> dict:
+        if not projection:
+            return doc
+        included = [key for key, value in projection.items() if value and key != "_id"]
+        if included:
+            return {key: doc[key] for key in included if key in doc}
+        return {key: value for key, value in doc.items() if projection.get(key, 1)}
+
+    def create_index(self, keys, name: str | None = None, **kwargs) -> str | None:
+        return name
+
+    def find(
+        self, filter: dict | None = None, projection: dict | None = None
+    ) -> MemoryCursor:
+        with self._lock:
+            docs = [
+                self._project(copy.deepcopy(doc), projection)
+                for doc in self._docs
+                if self._matches(doc, filter)
+            ]
+        return MemoryCursor(docs)
+
+    def find_one(
+        self, filter: dict | None = None, projection: dict | None = None
+    ) -> dict | None:
+        return next(iter(self.find(filter, projection)), None)
+
+    def replace_one(self, filter: dict, doc: dict, upsert: bool = False) -> None:
+        with self._lock:
+            for i, stored in enumerate(self._docs):
+                if self._matches(stored, filter):
+                    self._docs[i] = copy.deepcopy(doc)
+                    return
+            if upsert:
+                self._docs.append(copy.deepcopy(doc))
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False) -> None:
+        fields = copy.deepcopy(update["$set"])
+        with self._lock:
+            for stored in self._docs:
+                if self._matches(stored, filter):
+                    stored.update(fields)
+                    return
+            if upsert:
+                self._docs.append({**filter, **fields})
+
+    def bulk_write(
+        self, requests: list[pymongo.UpdateOne], ordered: bool = True
+    ) -> None:
+        for request in requests:
+            self.update_one(request._filter, request._doc, request._upsert)
+
+
+class QueueProducer:
+    """
+    In-process stand-in for AIOKafkaProducer, every topic is an asyncio queue
+
+    Messages are acknowledged as soon as they are queued.
+    """
+
+    def __init__(self) -> None:
+        self.topics: defaultdict[str, asyncio.Queue] = defaultdict(asyncio.Queue)
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def send(
+        self, topic: str, value: bytes, key: bytes | None = None
+    ) -> asyncio.Future:
+        await self.topics[topic].put((key, value))
+        delivery = asyncio.get_running_loop().create_future()
+        delivery.set_result(None)
+        return delivery
+
+
+def decode_anomaly(value: bytes) -> tuple[int, int, str]:
+    """
+    Read query id, second and class of a binary or json anomaly message
+    """
+    if value[: len(MAGIC)] == MAGIC:
+        _, _, _, idx, _, query_id, cls_len = HEADER.unpack_from(value)
+        cls = value[HEADER.size : HEADER.size + cls_len].decode("utf-8")
+        return query_id, idx, cls
+
+    message = json.loads(value)
+    return message["query_id"], message["idx"], message["cls"]
+
+
+async def store_anomalies(
+    queue: asyncio.Queue, col: MemoryCollection, results: ResultCache
+) -> None:
+    """
+    Stand-in for the responser: store anomalies without frames and announce them
+    """
+    while True:
+        _, value = await queue.get()
+        query_id, ts, cls = decode_anomaly(value)
+        col.update_one(
+            {"query_id": query_id, "ts": ts},
+            {"$set": {"cls": cls, "cnt": 0, "links": []}},
+            upsert=True,
+        )
+        results.invalidate(query_id)
+
+
+def percentiles(latencies: list[float]) -> dict:
+    ms = np.array(latencies) * 1000
+    return {
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+def cpu_seconds() -> float:
+    # children are the ffmpeg subprocesses that already exited
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+async def run_load(
+    stub: pb.detection_pb2_grpc.MlServiceStub,
+    videos: dict[int, str],
+    requests: int,
+    concurrency: int,
+    rgb_share: float,
+    find_share: float,
+    seed: int,
+) -> list[dict]:
+    """
+    Send `requests` calls from `concurrency` clients at once
+
+    Every call is FindResult of a finished query with probability `find_share`
+    and Process otherwise, Process uses the Rgb model with probability
+    `rgb_share` and a video of random length.
+    """
+    rng = random.Random(seed)
+    lengths = sorted(videos)
+    next_id = iter(range(1, requests + 1))
+    finished: list[int] = []
+    calls = []
+
+    async def client() -> None:
+        while (query_id := next(next_id, None)) is not None:
+            if finished and rng.random() < find_share:
+                target = rng.choice(finished)
+                started = time.perf_counter()
+                try:
+                    await stub.FindResult(ResultReq(id=target))
+                    ok = True
+                except grpc.aio.AioRpcError as ex:
+                    print(f"FindResult {target} failed: {ex.code()}")
+                    ok = False
+                calls.append(
+                    {
+                        "call": "FindResult",
+                        "latency": time.perf_counter() - started,
+                        "ok": ok,
+                        "seconds": 0,
+                    }
+                )
+                continue
+
+            model = ModelChoice.Rgb if rng.random() < rgb_share else ModelChoice.Bytes
+            seconds = rng.choice(lengths)
+            query = Query(id=query_id, source=videos[seconds], model=model)
+            started = time.perf_counter()
+            try:
+                response = await stub.Process(query)
+                ok = response.status == ResponseStatus.Success
+            except grpc.aio.AioRpcError as ex:
+                print(f"Process {query_id} failed: {ex.code()}")
+                ok = False
+            calls.append(
+                {
+                    "call": f"Process.{ModelChoice.Name(model)}",
+                    "latency": time.perf_counter() - started,
+                    "ok": ok,
+                    "seconds": seconds if ok else 0,
+                }
+            )
+            if ok:
+                finished.append(query_id)
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return calls
+
+
+def summarize(calls: list[dict], wall: float, cpu: float) -> dict:
+    by_call = defaultdict(list)
+    for call in calls:
+        by_call[call["call"]].append(call)
+
+    summary = []
+    for name, group in sorted(by_call.items()):
+        summary.append(
+            {
+                "call": name,
+                "n": len(group),
+                "errors": sum(not call["ok"] for call in group),
+                **percentiles([call["latency"] for call in group]),
+            }
+        )
+    video_seconds = sum(call["seconds"] for call in calls)
+    return {
+        "wall_seconds": wall,
+        "video_seconds": video_seconds,
+        "video_seconds_per_second": video_seconds / wall,
+        "calls_per_second": len(calls) / wall,
+        "cpu_utilisation": cpu / (wall * (os.cpu_count() or 1)),
+        "calls": summary,
+    }
+
+
+async def run(args: argparse.Namespace, root: str) -> dict:
+    storage = LocalObjectStore(root)
+    videos = {}
+    width, height = map(int, args.resolution.split("x"))
+    for seconds in map(int, args.seconds.split(",")):
+        name = f"loadtest_{seconds}s.mp4"
+        path = f"{root}/{name}"
+        # the service reads whole seconds but the last one
+        make_video(path, width, height, args.fps, seconds + 1)
+        storage.put("detection-video", name, path)
+        videos[seconds] = name
+
+    # inference processes optimize the shared fp32 model themselves
+    cb_model, resnet_model = load_models(
+        args.cb_checkpoint,
+        args.resnet_checkpoint,
+        args.variant,
+        optimize=not args.inference_processes,
+    )
+    inference = None
+    if args.inference_processes:
+        inference = InferencePool(
+            resnet_model,
+            cb_model,
+            args.variant,
+            args.inference_processes,
+            max((os.cpu_count() or 1) // args.inference_processes, 1),
+            # random inputs and no accuracy check, as in benchmark.load_models
+            torch.randn(8, 2, 3, 224, 224),
+            0.0,
+            [1, 8],
+        )
+        await inference.start()
+    anomalies = MemoryCollection()
+    producer = QueueProducer()
+    service = MlService(
+        resnet_model,
+        cb_model,
+        ResNetProcess(),
+        SignalProcess(),
+        # without model ids repeated videos are analysed again instead of reused
+        model_ids=(
+            {
+                "Rgb": checkpoint_id(
+                    args.resnet_checkpoint,
+                    inference.variant if inference else resnet_model.variant,
+                ),
+                "Bytes": checkpoint_id(args.cb_checkpoint),
+            }
+            if args.cache
+            else None
+        ),
+        storage=storage,
+        anomalies=anomalies,
+        completed_runs=MemoryCollection(),
+        producer=producer,
+        inference=inference,
+    )
+    responser = asyncio.create_task(
+        store_anomalies(producer.topics["anomalies"], anomalies, service.results)
+    )
+
+    server = grpc.aio.server(futures.ThreadPoolExecutor(max_workers=10))
+    pb.detection_pb2_grpc.add_MlServiceServicer_to_server(service, server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+    try:
+        async with grpc.aio.insecure_channel(f"127.0.0.1:{port}") as channel:
+            stub = pb.detection_pb2_grpc.MlServiceStub(channel)
+            print(
+                f"{args.requests} calls from {args.concurrency} clients, "
+                f"videos of {args.seconds} seconds"
+            )
+            cpu = cpu_seconds()
+            started = time.perf_counter()
+            calls = await run_load(
+                stub,
+                videos,
+                args.requests,
+                args.concurrency,
+                args.rgb_share,
+                args.find_share,
+                args.seed,
+            )
+            wall = time.perf_counter() - started
+            cpu = cpu_seconds() - cpu
+    finally:
+        await server.stop(5)
+        responser.cancel()
+        if inference is not None:
+            inference.shutdown()
+
+    return summarize(calls, wall, cpu)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Load-test MlService with local stand-ins for S3, Kafka and Mongo"
+    )
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--seconds", default="10", help="video lengths to choose from")
+    parser.add_argument("--resolution", default="640x360")
+    parser.add_argument("--fps", type=int, default=25)
+    parser.add_argument("--rgb-share", type=float, default=0.5)
+    parser.add_argument("--find-share", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--cache", action="store_true", help="reuse segments and runs as in production"
+    )
+    parser.add_argument(
+        "--inference-processes",
+        type=int,
+        default=int(os.getenv("INFERENCE_PROCESSES", 0)),
+        help="inference worker processes sharing the ResNet weights, 0 for none",
+    )
+    parser.add_argument("--variant", default=os.getenv("RGB_VARIANT", "fp32"))
+    parser.add_argument("--cb-checkpoint", default="./cb_checkpoint")
+    parser.add_argument("--resnet-checkpoint", default="./resnet_checkpoint")
+    parser.add_argument("--output", default="loadtest.json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        report = asyncio.run(run(args, root))
+    executors.shutdown()
+
+    report["meta"] = {
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "cpu": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        **vars(args),
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for call in report["calls"]:
+        print(
+            f"{call['call']:16} n={call['n']:<5} errors={call['errors']:<3} "
+            f"p50={call['p50_ms']:9.1f} p95={call['p95_ms']:9.1f} "
+            f"p99={call['p99_ms']:9.1f} ms"
+        )
+    print(
+        f"{report['video_seconds_per_second']:.2f} seconds of video per second, "
+        f"{report['calls_per_second']:.2f} calls per second, "
+        f"cpu {report['cpu_utilisation']:.0%}"
+    )
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
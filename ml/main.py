@@ -1,6 +1,8 @@
-import tempfile
 import os
 from concurrent import futures
+from contextlib import aclosing, asynccontextmanager
+from fractions import Fraction
+from typing import AsyncIterator
 
 import ffmpeg
 import grpc
@@ -14,21 +16,46 @@ from pb.detection_pb2 import (
     ResultReq,
     ResultResp,
     Anomaly,
+    AnomalyEvent,
+    ProcessEvent,
+    Progress,
     Model as ModelChoice,
 )
 
 from dataset import DataProcess, SignalProcess, ResNetProcess
-from model import Model, CatBoost, DLModel
-from video import save_bin
+from model import Model, CatBoost, DLModel, proba_agreement
+from video import extract_segment, packet_histograms, segment_stream
+from pipeline import batched, stage, unbatched
+from executors import iterate_io, run_cpu, run_io
+from live import LagStats, drop_stale
+from message import encode_anomaly
+from publisher import Publisher
+from results import ResultCache, find_anomalies, paginate
+from cache import DiskCache, checkpoint_id, content_hash
+from inference import InferencePool
+from metrics import (
+    ANOMALIES,
+    BATCH_SIZE,
+    CACHE_LOOKUPS,
+    QUERY_THROUGHPUT,
+    STAGE_SECONDS,
+    VIDEO_SECONDS,
+    timed,
+    track_query,
+)
+from profiling import QueryProfile, current_profile, profiled
+import executors
 
 from minio import Minio
+from prometheus_client import start_http_server
 import pymongo
+from pymongo.collection import Collection
 import aiokafka
 import asyncio
 import json
-import aiofiles
 import base64
-
+import numpy as np
+import torch
 
 load_dotenv(".env")
 
@@ -42,6 +69,90 @@ s3 = Minio(
 mongo_url = f"mongodb://{os.getenv('MONGO_HOST')}:{os.getenv('MONGO_PORT')}/{os.getenv('MONGO_DB')}"
 mongo_client = pymongo.MongoClient(mongo_url)
 col = mongo_client.get_database(os.getenv("MONGO_DB")).get_collection("anomalies")
+# completed analyses by source ETag and model, to answer repeated queries at once
+runs = mongo_client.get_database(os.getenv("MONGO_DB")).get_collection("runs")
+
+RGB_BATCH_SIZE = int(os.getenv("RGB_BATCH_SIZE", 8))
+RGB_BATCH_WAIT = float(os.getenv("RGB_BATCH_WAIT_MS", 500)) / 1000
+# fp32 or "+"-joined optimisations from model.DL_VARIANTS, checked against fp32 at startup
+RGB_VARIANT = os.getenv("RGB_VARIANT", "fp32")
+RGB_CALIBRATION_DIR = os.getenv("RGB_CALIBRATION_DIR")
+RGB_CALIBRATION_SIZE = int(os.getenv("RGB_CALIBRATION_SIZE", 32))
+RGB_MIN_AGREEMENT = float(os.getenv("RGB_MIN_AGREEMENT", 0.98))
+BYTES_BATCH_SIZE = int(os.getenv("BYTES_BATCH_SIZE", 16))
+BYTES_BATCH_WAIT = float(os.getenv("BYTES_BATCH_WAIT_MS", 500)) / 1000
+
+# encode: histograms of re-encoded segments, packets: histograms of source packets
+BYTES_SOURCE = os.getenv("BYTES_SOURCE", "encode")
+PACKET_CHECK_SECONDS = int(os.getenv("PACKET_CHECK_SECONDS", 10))
+PACKET_MIN_AGREEMENT = float(os.getenv("PACKET_MIN_AGREEMENT", 0.9))
+PACKET_PROBA_TOLERANCE = float(os.getenv("PACKET_PROBA_TOLERANCE", 0.1))
+
+# live streams: windows waiting for processing and the oldest window allowed to wait
+LIVE_MAX_PENDING = int(os.getenv("LIVE_MAX_PENDING", 4))
+LIVE_MAX_LATENCY = float(os.getenv("LIVE_MAX_LATENCY_MS", 3000)) / 1000
+
+# binary or json (legacy base64 payload), compression is none, zstd or lz4
+KAFKA_MESSAGE_FORMAT = os.getenv("KAFKA_MESSAGE_FORMAT", "binary")
+KAFKA_COMPRESSION = os.getenv("KAFKA_COMPRESSION", "none")
+KAFKA_LINGER_MS = int(os.getenv("KAFKA_LINGER_MS", 20))
+KAFKA_MAX_BATCH_SIZE = int(os.getenv("KAFKA_MAX_BATCH_SIZE", 1048576))
+KAFKA_MAX_REQUEST_SIZE = int(os.getenv("KAFKA_MAX_REQUEST_SIZE", 1048576))
+KAFKA_MAX_IN_FLIGHT = int(os.getenv("KAFKA_MAX_IN_FLIGHT", 32))
+
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL_MS", 1000)) / 1000
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", 2))
+INFER_WORKERS = int(os.getenv("INFER_WORKERS", 1))
+PUBLISH_WORKERS = int(os.getenv("PUBLISH_WORKERS", 1))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 16))
+
+# inference processes sharing the ResNet weights, 0 runs inference in this process;
+# INFER_WORKERS should be at least this to keep them busy
+INFERENCE_PROCESSES = int(os.getenv("INFERENCE_PROCESSES", 0))
+# torch threads of every inference process, cores are split evenly by default
+INFERENCE_THREADS = int(
+    os.getenv("INFERENCE_THREADS")
+    or max((os.cpu_count() or 1) // max(INFERENCE_PROCESSES, 1), 1)
+)
+
+RESULT_BATCH_SIZE = int(os.getenv("RESULT_BATCH_SIZE", 1000))
+RESULT_CACHE_QUERIES = int(os.getenv("RESULT_CACHE_QUERIES", 256))
+# responser announces query ids with new anomalies here
+UPDATES_TOPIC = os.getenv("UPDATES_TOPIC", "anomalies-updates")
+UPDATES_BACKOFF = float(os.getenv("UPDATES_BACKOFF_MS", 500)) / 1000
+UPDATES_MAX_BACKOFF = float(os.getenv("UPDATES_MAX_BACKOFF_MS", 30000)) / 1000
+
+# features and predictions of segments by content hash, empty dir disables the cache
+SEGMENT_CACHE_DIR = os.getenv("SEGMENT_CACHE_DIR", "./segment_cache")
+SEGMENT_CACHE_MAX_BYTES = int(os.getenv("SEGMENT_CACHE_MAX_MB", 2048)) * 1024 * 1024
+
+# queries profiled besides those with the profile flag, comma separated ids
+PROFILE_QUERY_IDS = {int(i) for i in os.getenv("PROFILE_QUERY_IDS", "").split(",") if i}
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+
+# idx, segment, content hash, features, cached label and probability
+Prepared = tuple[
+    int,
+    bytes | None,
+    str | None,
+    np.ndarray | torch.Tensor | None,
+    tuple[str, float] | None,
+]
+
+
+def result_event(status: ResponseStatus) -> ProcessEvent:
+    return ProcessEvent(result=Response(status=status))
+
+
+def progress_event(seconds_processed: int, elapsed: float) -> ProcessEvent:
+    return ProcessEvent(
+        progress=Progress(
+            seconds_processed=seconds_processed,
+            throughput=seconds_processed / elapsed if elapsed > 0 else 0.0,
+        )
+    )
 
 
 class MlService(pb.detection_pb2_grpc.MlServiceServicer):
@@ -51,6 +162,12 @@ class MlService(pb.detection_pb2_grpc.MlServiceServicer):
         model_bytes: Model,
         data_process_rgb: ResNetProcess,
         data_process_bytes: DataProcess,
+        model_ids: dict[str, str] | None = None,
+        storage: Minio | None = None,
+        anomalies: Collection | None = None,
+        completed_runs: Collection | None = None,
+        producer: aiokafka.AIOKafkaProducer | None = None,
+        inference: InferencePool | None = None,
     ) -> None:
         super().__init__()
 
@@ -58,114 +175,481 @@ class MlService(pb.detection_pb2_grpc.MlServiceServicer):
         self._model_bytes = model_bytes
         self._data_process_rgb = data_process_rgb
         self._data_process_bytes = data_process_bytes
-        self.producer = aiokafka.AIOKafkaProducer(
-            bootstrap_servers=os.getenv("KAFKA_HOST"),
-            value_serializer=lambda x: json.dumps(x).encode(encoding="utf-8"),
-            acks="all",
-            enable_idempotence=True,
-        )
+        # S3, Mongo and Kafka clients of the module unless replaced, e.g. by loadtest.py
+        self.s3 = storage if storage is not None else s3
+        self.col = anomalies if anomalies is not None else col
+        self.runs = completed_runs if completed_runs is not None else runs
+        if producer is None:
+            producer = aiokafka.AIOKafkaProducer(
+                bootstrap_servers=os.getenv("KAFKA_HOST"),
+                acks="all",
+                enable_idempotence=True,
+                linger_ms=KAFKA_LINGER_MS,
+                max_batch_size=KAFKA_MAX_BATCH_SIZE,
+                max_request_size=KAFKA_MAX_REQUEST_SIZE,
+            )
+        self.producer = producer
+        self.inference = inference
+        self.publisher = Publisher(self.producer, KAFKA_MAX_IN_FLIGHT)
+        self.results = ResultCache(RESULT_CACHE_QUERIES)
+        self._model_ids = model_ids
+        self.cache = None
+        if SEGMENT_CACHE_DIR and model_ids is not None:
+            self.cache = DiskCache(SEGMENT_CACHE_DIR, SEGMENT_CACHE_MAX_BYTES)
+
+    async def watch_updates(self) -> None:
+        """
+        Drop cached results of queries the responser wrote new anomalies for
+
+        Every instance reads all partitions without a consumer group, so each
+        in-process cache sees every update. The consumer is restarted after a
+        failure, and results are not cached until it is running again.
+        """
+        backoff = UPDATES_BACKOFF
+        while True:
+            consumer = aiokafka.AIOKafkaConsumer(
+                UPDATES_TOPIC,
+                bootstrap_servers=os.getenv("KAFKA_HOST"),
+                auto_offset_reset="latest",
+            )
+            try:
+                await consumer.start()
+                self.results.resume()
+                backoff = UPDATES_BACKOFF
+                async for msg in consumer:
+                    try:
+                        query_id = int(msg.value)
+                    except ValueError:
+                        print(f"Skipping malformed update {msg.value!r}")
+                        continue
+                    self.results.invalidate(query_id)
+            except Exception as ex:
+                print(f"Updates consumer failed, restarting in {backoff:.1f}s: {ex}")
+            finally:
+                self.results.pause()
+                await consumer.stop()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, UPDATES_MAX_BACKOFF)
+
+    async def prepare(self, segment: tuple[int, bytes], model_choice: str) -> Prepared:
+        idx, data = segment
+        key = None
+        if self.cache is not None:
+            key = await run_cpu(content_hash, data)
+            prediction = await run_io(
+                self.cache.get, f"{key}-{self._model_ids[model_choice]}"
+            )
+            CACHE_LOOKUPS.labels(
+                "prediction", "miss" if prediction is None else "hit"
+            ).inc()
+            if prediction is not None:
+                return idx, data, key, None, prediction
+            X = await run_io(self.cache.get, f"{key}-{model_choice}")
+            CACHE_LOOKUPS.labels("features", "miss" if X is None else "hit").inc()
+            if X is not None:
+                return idx, data, key, X, None
+
+        with STAGE_SECONDS.labels("preprocess", model_choice).time():
+            if model_choice == "Bytes":
+                X = await run_cpu(self._data_process_bytes.byte_histogram, data)
+            else:
+                X = await run_cpu(self._data_process_rgb.prepare_from_bytes, data)
+
+        if key is not None:
+            await run_io(self.cache.put, f"{key}-{model_choice}", X)
+        return idx, data, key, X, None
+
+    async def infer(
+        self, batch: list[Prepared], model_choice: str
+    ) -> list[tuple[int, bytes | None, str, float]]:
+        # segments seen before with the same model skip inference
+        missed = [X for *_, X, prediction in batch if prediction is None]
+        if not missed:
+            labels, probas = [], []
+        else:
+            BATCH_SIZE.labels(model_choice).observe(len(missed))
+            with STAGE_SECONDS.labels("inference", model_choice).time():
+                X = np.stack(missed) if model_choice == "Bytes" else torch.cat(missed)
+                if self.inference is not None:
+                    labels, probas = await self.inference.predict(model_choice, X)
+                elif model_choice == "Bytes":
+                    labels, probas = await run_cpu(
+                        lambda: self._model_bytes.predict_with_proba(
+                            self._data_process_bytes.prepare_histograms(X)
+                        )
+                    )
+                else:
+                    predict = self._model_rgb.predict_with_proba
+                    if (profile := current_profile()) is not None:
+                        predict = profile.torch(predict)
+                    labels, probas = await run_cpu(predict, X)
+
+        predicted = iter(zip(labels, probas))
+        results, stores = [], []
+        for idx, data, key, _, prediction in batch:
+            if prediction is None:
+                label, proba = next(predicted)
+                prediction = str(label), float(proba)
+                if key is not None:
+                    stores.append(
+                        run_io(
+                            self.cache.put,
+                            f"{key}-{self._model_ids[model_choice]}",
+                            prediction,
+                        )
+                    )
+            results.append((idx, data, *prediction))
+        await asyncio.gather(*stores)
 
-    async def detect_frame_anomaly(
+        return results
+
+    async def publish(
         self,
+        prediction: tuple[int, bytes | None, str, float],
         url: str,
-        tmpdirname: str,
-        idx: int,
         fps: int,
         query_id: int,
         model_choice: str,
     ) -> dict:
-        bin_path = save_bin(url, tmpdirname, idx, fps)
-
-        X = (
-            self._data_process_bytes.prepare_from_bin(bin_path).to_numpy()
-            if model_choice == "Bytes"
-            else self._data_process_rgb.prepare_from_bin(bin_path)
-        )
-
-        label = (
-            self._model_bytes.predict(X)[0]
-            if model_choice == "Bytes"
-            else self._model_rgb.predict(X)[0]
-        )
-
+        idx, data, label, proba = prediction
         if label == "normal":
             return {}
 
         print(f"Anomaly detected at {idx} with label {label}")
 
-        async with aiofiles.open(bin_path, "rb") as bin_f:
-            data = await bin_f.read()
-            data = base64.b64encode(data).decode("utf-8")
-            await self.producer.send_and_wait(
-                "anomalies",
-                {
-                    "idx": idx,
-                    "cls": label,
-                    "fps": fps,
-                    "query_id": query_id,
-                    "data": data,
-                },
+        if data is None:
+            # second came from packet histograms, encode it only when it is reported
+            with STAGE_SECONDS.labels("extract_segment", "Bytes").time():
+                data = await run_io(extract_segment, url, idx, fps)
+
+        with STAGE_SECONDS.labels("publish", model_choice).time():
+            if KAFKA_MESSAGE_FORMAT == "json":
+                value = json.dumps(
+                    {
+                        "idx": idx,
+                        "cls": label,
+                        "fps": fps,
+                        "query_id": query_id,
+                        "data": base64.b64encode(data).decode("utf-8"),
+                    }
+                ).encode(encoding="utf-8")
+            else:
+                value = encode_anomaly(
+                    idx, label, fps, query_id, data, KAFKA_COMPRESSION
+                )
+            # anomalies of a query share a partition and reach the responser in order
+            delivery = await self.publisher.send(
+                "anomalies", value, key=str(query_id).encode()
+            )
+        ANOMALIES.labels(model_choice, label).inc()
+
+        return {
+            "ts": idx,
+            "class": label,
+            "probability": proba,
+            "delivery": delivery,
+        }
+
+    async def packet_stream(self, url: str, seconds: int) -> AsyncIterator[Prepared]:
+        async with aclosing(iterate_io(packet_histograms(url, seconds))) as packets:
+            async for idx, hist in packets:
+                yield idx, None, None, hist, None
+
+    async def replay(self, run: dict, query_id: int) -> bool:
+        """
+        Copy stored anomalies of a completed run to another query
+
+        Returns:
+            bool: False if the responser has not stored every anomaly of the run yet
+        """
+        anomalies = await run_io(
+            lambda: list(self.col.find({"query_id": run["query_id"]}, {"_id": 0}))
+        )
+        if len(anomalies) < len(run["anomalies"]):
+            return False
+
+        requests = [
+            pymongo.UpdateOne(
+                {"query_id": query_id, "ts": anomaly["ts"]},
+                {"$set": {**anomaly, "query_id": query_id}},
+                upsert=True,
             )
+            for anomaly in anomalies
+        ]
+        if requests:
+            await run_io(self.col.bulk_write, requests, ordered=False)
+        self.results.invalidate(query_id)
+        return True
+
+    async def packets_compatible(self, url: str, fps: int, seconds: int) -> bool:
+        """
+        Check that packet histograms give the same predictions as re-encoded segments
+
+        CatBoost was trained on histograms of re-encoded segments, so packet
+        histograms are used only if the class probabilities of the first seconds
+        of video stay within PACKET_PROBA_TOLERANCE of each other.
+        """
+        seconds = min(seconds, PACKET_CHECK_SECONDS)
+        async with aclosing(iterate_io(packet_histograms(url, seconds))) as packets:
+            packet_hists = {idx: hist async for idx, hist in packets}
+        async with aclosing(segment_stream(url, fps, seconds)) as segments:
+            encoded_hists = {
+                idx: self._data_process_bytes.byte_histogram(data)
+                async for idx, data in segments
+            }
+
+        common = sorted(packet_hists.keys() & encoded_hists.keys())
+        if not common:
+            return False
+
+        packet_proba, encoded_proba = await run_cpu(
+            lambda: [
+                self._model_bytes.predict_proba(
+                    self._data_process_bytes.prepare_histograms(
+                        np.stack([hists[idx] for idx in common])
+                    )
+                )
+                for hists in (packet_hists, encoded_hists)
+            ]
+        )
+        agreement = proba_agreement(encoded_proba, packet_proba, PACKET_PROBA_TOLERANCE)
+        print(f"packet histograms agree on {agreement:.0%} of {len(common)} seconds")
 
-        return {"ts": idx, "class": label}
+        return agreement >= PACKET_MIN_AGREEMENT
 
-    async def Process(self, query: Query, context: grpc.aio.ServicerContext):
+    async def analyse(
+        self, query: Query, context: grpc.aio.ServicerContext
+    ) -> AsyncIterator[ProcessEvent]:
+        """
+        Run the pipeline for a query and report what happens as it happens
+
+        Yields anomaly events as soon as they are published, progress at most
+        every PROGRESS_INTERVAL_MS and the final status as the last event.
+        """
         print(query.source)
+        self.results.invalidate(query.id)
         model_choice = "Rgb" if query.model == ModelChoice.Rgb else "Bytes"
+
+        # the same object analysed by the same model before
+        run_key = None
+        if not query.source.startswith("rtsp") and self._model_ids is not None:
+            stat = await run_io(self.s3.stat_object, "detection-video", query.source)
+            run_key = {"etag": stat.etag, "model": self._model_ids[model_choice]}
+            run = await run_io(self.runs.find_one, run_key)
+            if run is not None and await self.replay(run, query.id):
+                print(f"reusing results of query {run['query_id']}")
+                for anomaly in run["anomalies"]:
+                    yield ProcessEvent(anomaly=AnomalyEvent(**anomaly))
+                yield progress_event(run["seconds"], 0)
+                yield result_event(ResponseStatus.Success)
+                return
+
         url = query.source
         if not query.source.startswith("rtsp"):
-            url = s3.presigned_get_object("detection-video", query.source)
+            url = await run_io(
+                self.s3.presigned_get_object, "detection-video", query.source
+            )
         print(f"url = {url}")
 
-        probe = ffmpeg.probe(url)
+        probe = await run_io(ffmpeg.probe, url)
         video_info = next(s for s in probe["streams"] if s["codec_type"] == "video")
-        fps = video_info["r_frame_rate"].split("/")
-        fps = int(fps[0]) // int(fps[1])
-        num_frames = int(video_info["nb_frames"])
-        frames_to_read = list(range(num_frames // fps - 1))
-
-        tmpdirname = tempfile.TemporaryDirectory()
-
-        anomalies = []  # list[ {"ts": int, 'class': str}, ... ]
-
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            for idx in frames_to_read:
-                if context.cancelled():
-                    print("cancelled")
-                    return Response(status=ResponseStatus.Canceled)
-
-                try:
-                    anomaly = await self.detect_frame_anomaly(
-                        url,
-                        str(tmpdirname),
-                        idx,
-                        fps,
-                        query.id,
-                        model_choice,
-                    )
-                except Exception as ex:
-                    print(str(ex))
-                    return Response(status=ResponseStatus.Error)
+        rate = Fraction(video_info["r_frame_rate"])
+        fps = int(rate)
+
+        # live stream has no length, it is read until the RPC is cancelled
+        live = query.source.startswith("rtsp")
+        seconds_to_read = None
+        queue_size = min(PIPELINE_QUEUE_SIZE, LIVE_MAX_PENDING)
+        lag = LagStats(LIVE_MAX_LATENCY) if live else LagStats()
+        if not live:
+            num_frames = int(video_info["nb_frames"])
+            seconds_to_read = max(int(num_frames / rate) - 1, 0)
+            queue_size = PIPELINE_QUEUE_SIZE
+
+        batch_size, batch_wait = (
+            (RGB_BATCH_SIZE, RGB_BATCH_WAIT)
+            if model_choice == "Rgb"
+            else (BYTES_BATCH_SIZE, BYTES_BATCH_WAIT)
+        )
 
-                if not anomaly:
-                    continue
+        try:
+            # extract -> preprocess -> infer -> publish, stages overlap and are
+            # connected with bounded queues
+            if (
+                model_choice == "Bytes"
+                and BYTES_SOURCE == "packets"
+                and not live
+                and await self.packets_compatible(url, fps, seconds_to_read)
+            ):
+                prepared = self.packet_stream(url, seconds_to_read)
+            else:
+                segments = timed(
+                    segment_stream(url, fps, seconds_to_read),
+                    STAGE_SECONDS.labels("segment", model_choice),
+                )
+                if (profile := current_profile()) is not None:
+                    segments = profile.trace_items(segments, "segment")
+                if live:
+                    segments = drop_stale(segments, LIVE_MAX_PENDING, lag)
+                prepared = stage(
+                    segments,
+                    lambda segment: self.prepare(segment, model_choice),
+                    PREPROCESS_WORKERS,
+                    queue_size,
+                    "preprocess",
+                )
+            # windows keep aging in the queues, late ones are dropped before
+            # inference and before publishing
+            predicted = stage(
+                batched(prepared, batch_size, batch_wait),
+                lambda batch: self.infer(lag.fresh(batch), model_choice),
+                INFER_WORKERS,
+                queue_size,
+                "inference",
+            )
 
-                anomalies.append(anomaly)
+            async def publish(
+                prediction: tuple[int, bytes | None, str, float],
+            ) -> dict | None:
+                if not lag.on_time(prediction[0]):
+                    return None
+                anomaly = await self.publish(
+                    prediction, url, fps, query.id, model_choice
+                )
+                lag.done(prediction[0])
+                return anomaly
+
+            published = stage(
+                unbatched(predicted),
+                publish,
+                PUBLISH_WORKERS,
+                queue_size,
+                "publish",
+            )
+
+            loop = asyncio.get_running_loop()
+            started = last_progress = loop.time()
+            seconds_processed = 0
+            deliveries = []
+            found = []
+            async with aclosing(published):
+                async for anomaly in published:
+                    if context.cancelled():
+                        print("cancelled")
+                        yield result_event(ResponseStatus.Canceled)
+                        return
+                    if anomaly is None:
+                        continue
+
+                    seconds_processed += 1
+                    VIDEO_SECONDS.labels(model_choice).inc()
+                    if anomaly:
+                        deliveries.append(anomaly["delivery"])
+                        found.append(
+                            {
+                                "ts": anomaly["ts"],
+                                "cls": anomaly["class"],
+                                "probability": anomaly["probability"],
+                            }
+                        )
+                        yield ProcessEvent(anomaly=AnomalyEvent(**found[-1]))
+
+                    if loop.time() - last_progress >= PROGRESS_INTERVAL:
+                        last_progress = loop.time()
+                        event = progress_event(
+                            seconds_processed, last_progress - started
+                        )
+                        QUERY_THROUGHPUT.labels(str(query.id)).set(
+                            event.progress.throughput
+                        )
+                        yield event
+
+            # wait until the broker has every anomaly of the query
+            await asyncio.gather(*deliveries)
+            if run_key is not None:
+                await run_io(
+                    self.runs.replace_one,
+                    run_key,
+                    {
+                        **run_key,
+                        "query_id": query.id,
+                        "seconds": seconds_processed,
+                        "anomalies": found,
+                    },
+                    upsert=True,
+                )
+        except Exception as ex:
+            print(str(ex))
+            yield result_event(ResponseStatus.Error)
+            return
 
-            # tmpdirname.cleanup()
+        if live:
+            print(f"live stream finished, {lag}")
         print("finished processing")
-        return Response(status=ResponseStatus.Success)
+        yield progress_event(seconds_processed, loop.time() - started)
+        yield result_event(ResponseStatus.Success)
+
+    @asynccontextmanager
+    async def profile_query(self, query: Query) -> AsyncIterator[None]:
+        """
+        Profile the query if it asks for it or is in PROFILE_QUERY_IDS
+        """
+        if not query.profile and query.id not in PROFILE_QUERY_IDS:
+            yield
+            return
+
+        profile = QueryProfile(query.id, PROFILE_DIR)
+        try:
+            with profiled(profile):
+                yield
+        finally:
+            await run_io(
+                profile.save,
+                query_id=query.id,
+                source=query.source,
+                model=query.model,
+            )
+            print(f"profile of query {query.id} written to {profile.dir}")
+
+    async def Process(self, query: Query, context: grpc.aio.ServicerContext):
+        with track_query(query.id):
+            async with self.profile_query(query), aclosing(
+                self.analyse(query, context)
+            ) as events:
+                async for event in events:
+                    if event.HasField("result"):
+                        return event.result
+
+    async def ProcessStream(self, query: Query, context: grpc.aio.ServicerContext):
+        with track_query(query.id):
+            async with self.profile_query(query), aclosing(
+                self.analyse(query, context)
+            ) as events:
+                async for event in events:
+                    yield event
 
     async def FindResult(self, query: ResultReq, context: grpc.aio.ServicerContext):
-        res: list[Anomaly] = []
         try:
-            anomalies = col.find({"query_id": query.id})
-            for anomaly in anomalies:
-                a = Anomaly(
-                    ts=anomaly["ts"], cls=anomaly["cls"], links=anomaly["links"]
+            anomalies = self.results.get(query.id)
+            if anomalies is None:
+                generation = self.results.generation(query.id)
+                anomalies = await run_io(
+                    find_anomalies, self.col, query.id, RESULT_BATCH_SIZE
                 )
-                res.append(a)
-            return ResultResp(anomalies=res)
+                self.results.put(query.id, anomalies, generation)
+
+            page, next_cursor = paginate(
+                anomalies, query.offset, query.limit, query.cursor
+            )
+            return ResultResp(
+                anomalies=[
+                    Anomaly(
+                        ts=anomaly["ts"], cls=anomaly["cls"], links=anomaly["links"]
+                    )
+                    for anomaly in page
+                ],
+                next_cursor=next_cursor,
+            )
         except Exception as e:
             print(e)
             return ResultResp(anomalies=[])
@@ -179,20 +663,65 @@ async def serve():
     cb_model.load(cb_checkpoint_path)
     cb_data_process = SignalProcess()
 
-    resnet_model = DLModel()
+    resnet_model = DLModel(RGB_VARIANT)
     resnet_model.load(resnet_checkpoint_path)
     resnet_data_process = ResNetProcess()
+    calibration = resnet_data_process.calibration_set(
+        RGB_CALIBRATION_DIR, RGB_CALIBRATION_SIZE
+    )
+    inference = None
+    if INFERENCE_PROCESSES > 0:
+        # workers build the variant on top of the shared fp32 weights
+        inference = InferencePool(
+            resnet_model,
+            cb_model,
+            RGB_VARIANT,
+            INFERENCE_PROCESSES,
+            INFERENCE_THREADS,
+            calibration,
+            RGB_MIN_AGREEMENT,
+            sorted({1, RGB_BATCH_SIZE}),
+        )
+        await inference.start()
+        rgb_variant = inference.variant
+    else:
+        resnet_model.optimize(calibration, RGB_MIN_AGREEMENT)
+        resnet_model.warmup(sorted({1, RGB_BATCH_SIZE}))
+        rgb_variant = resnet_model.variant
 
     s = grpc.aio.server(futures.ThreadPoolExecutor(max_workers=10))
-    ml_service = MlService(resnet_model, cb_model, resnet_data_process, cb_data_process)
+    ml_service = MlService(
+        resnet_model,
+        cb_model,
+        resnet_data_process,
+        cb_data_process,
+        # results are reused only for the variant that actually produced them
+        model_ids={
+            "Rgb": checkpoint_id(resnet_checkpoint_path, rgb_variant),
+            "Bytes": checkpoint_id(cb_checkpoint_path),
+        },
+        inference=inference,
+    )
     pb.detection_pb2_grpc.add_MlServiceServicer_to_server(ml_service, s)
     s.add_insecure_port("[::]:10000")
 
+    start_http_server(METRICS_PORT)
+    await run_io(
+        runs.create_index,
+        [("etag", pymongo.ASCENDING), ("model", pymongo.ASCENDING)],
+        name="etag_model",
+        unique=True,
+    )
     await ml_service.producer.start()
+    updates = asyncio.create_task(ml_service.watch_updates())
     await s.start()
     await s.wait_for_termination()
     await s.stop(5)
+    updates.cancel()
     await ml_service.producer.stop()
+    if inference is not None:
+        inference.shutdown()
+    executors.shutdown()
 
 
 if __name__ == "__main__":
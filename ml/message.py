@@ -0,0 +1,52 @@
+import struct
+
+MAGIC = b"ANM1"
+# magic, version, codec, idx, fps, query_id, length of cls
+HEADER = struct.Struct("<4sBBqiqH")
+VERSION = 1
+
+CODECS = {"none": 0, "zstd": 1, "lz4": 2}
+
+
+def compress(data: bytes, compression: str) -> bytes:
+    if compression == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor().compress(data)
+    if compression == "lz4":
+        import lz4.frame
+
+        return lz4.frame.compress(data)
+    return data
+
+
+def encode_anomaly(
+    idx: int,
+    cls: str,
+    fps: int,
+    query_id: int,
+    data: bytes,
+    compression: str = "none",
+) -> bytes:
+    """
+    Pack anomaly into a binary Kafka message
+
+    The message is a fixed little-endian header, the class name in utf-8 and the
+    raw h264 segment, optionally compressed.
+
+    Args:
+        idx (int): second of the anomaly
+        cls (str): anomaly class
+        fps (int): framerate of the segment
+        query_id (int): id of the query
+        data (bytes): raw h264 segment
+        compression (str): none, zstd or lz4
+
+    Returns:
+        bytes: encoded message
+    """
+    cls = cls.encode("utf-8")
+    header = HEADER.pack(
+        MAGIC, VERSION, CODECS[compression], idx, fps, query_id, len(cls)
+    )
+    return b"".join((header, cls, compress(data, compression)))
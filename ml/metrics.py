@@ -0,0 +1,80 @@
+import time
+from contextlib import aclosing, contextmanager, suppress
+from typing import AsyncIterator, Iterator, TypeVar
+
+from prometheus_client import Counter, Gauge, Histogram
+
+T = TypeVar("T")
+
+# per segment or per batch, from a few milliseconds to a slow rtsp second
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_SECONDS = Histogram(
+    "ml_stage_seconds",
+    "Time spent in a pipeline stage per item",
+    ["stage", "model"],
+    buckets=BUCKETS,
+)
+BATCH_SIZE = Histogram(
+    "ml_batch_size",
+    "Segments per inference batch",
+    ["model"],
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+VIDEO_SECONDS = Counter(
+    "ml_video_seconds_total", "Seconds of video processed", ["model"]
+)
+ANOMALIES = Counter("ml_anomalies_total", "Anomalies published", ["model", "cls"])
+QUERY_THROUGHPUT = Gauge(
+    "ml_query_throughput",
+    "Seconds of video processed per second of a running query",
+    ["query_id"],
+)
+ACTIVE_QUERIES = Gauge("ml_active_queries", "Queries being processed")
+QUEUE_DEPTH = Gauge(
+    "ml_queue_depth", "Items waiting in front of a pipeline stage", ["stage"]
+)
+IN_FLIGHT = Gauge("ml_in_flight", "Calls of a pipeline stage running now", ["stage"])
+KAFKA_IN_FLIGHT = Gauge(
+    "ml_kafka_in_flight", "Kafka messages waiting for acknowledgement"
+)
+CACHE_LOOKUPS = Counter(
+    "ml_cache_lookups_total", "Segment cache lookups", ["kind", "result"]
+)
+LIVE_LAG = Histogram(
+    "ml_live_lag_seconds",
+    "Time from the arrival of a live window to its publication",
+    buckets=BUCKETS,
+)
+LIVE_DROPPED = Counter(
+    "ml_live_dropped_total",
+    "Live windows dropped: overflow when too many wait, late when too old",
+    ["reason"],
+)
+INFERENCE_RESTARTS = Counter(
+    "ml_inference_restarts_total",
+    "Inference process pools rebuilt after a worker died",
+)
+
+
+@contextmanager
+def track_query(query_id: int) -> Iterator[None]:
+    ACTIVE_QUERIES.inc()
+    try:
+        yield
+    finally:
+        ACTIVE_QUERIES.dec()
+        with suppress(KeyError):
+            QUERY_THROUGHPUT.remove(str(query_id))
+
+
+async def timed(items: AsyncIterator[T], histogram: Histogram) -> AsyncIterator[T]:
+    """
+    Observe how long every item of async iterator took to arrive
+    """
+    async with aclosing(items):
+        started = time.perf_counter()
+        async for item in items:
+            histogram.observe(time.perf_counter() - started)
+            yield item
+            started = time.perf_counter()
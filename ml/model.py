@@ -1,4 +1,5 @@
 import abc
+import copy
 import pickle
 from pathlib import Path
 
@@ -9,6 +10,36 @@ from catboost import CatBoostClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.preprocessing import LabelEncoder, MinMaxScaler
 from torch import nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+# optimisations of DLModel, combined with "+", e.g. "static_int8+traced"
+DL_VARIANTS = (
+    "fp32",
+    "channels_last",
+    "dynamic_int8",
+    "static_int8",
+    "traced",
+    "compiled",
+)
+
+
+def proba_agreement(
+    reference: np.ndarray, other: np.ndarray, tolerance: float
+) -> float:
+    """
+    Share of inputs whose class probabilities differ by at most `tolerance`
+
+    Args:
+        reference (np.ndarray): [N, n_class] probabilities
+        other (np.ndarray): [N, n_class] probabilities of the same inputs
+        tolerance (float): maximum absolute difference of every class
+
+    Returns:
+        float: agreement from 0 to 1, NaN probabilities never agree
+    """
+    diff = np.abs(reference - other).max(axis=1)
+    return float(np.mean(diff <= tolerance))
 
 
 class Model(abc.ABC):
@@ -16,6 +47,16 @@ class Model(abc.ABC):
     def predict(self, X: np.ndarray) -> np.ndarray:
         pass
 
+    @abc.abstractmethod
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        pass
+
+    def predict_with_proba(self, X: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Predict labels together with the probability of each predicted label
+        """
+        return self.predict(X), self.predict_proba(X).max(axis=1)
+
     @abc.abstractmethod
     def save(self, dir: str) -> None:
         pass
@@ -105,9 +146,26 @@ class ResNet(nn.Module):
 
 
 class DLModel(Model):
-    def __init__(
-        self,
-    ) -> None:
+    """
+    ResNet classifier of frame pairs
+
+    Inference runs the fp32 checkpoint unless `optimize` replaces it with one of
+    DL_VARIANTS:
+        channels_last: NHWC memory format, faster oneDNN convolutions
+        dynamic_int8: int8 weights of linear layers, activations quantized on the fly
+        static_int8: int8 backbone calibrated on sample inputs (FX graph mode)
+        traced: frozen TorchScript graph
+        compiled: torch.compile with dynamic batch size
+    """
+
+    def __init__(self, variant: str = "fp32") -> None:
+        options = variant.split("+")
+        assert all(option in DL_VARIANTS for option in options), variant
+        assert not {"dynamic_int8", "static_int8"} <= set(options)
+        assert not {"traced", "compiled"} <= set(options)
+
+        self._requested = variant
+        self._variant = "fp32"
         self._model = ResNet(5).to("cpu")
         self._le = LabelEncoder()
         self.model.eval()
@@ -120,11 +178,139 @@ class DLModel(Model):
     def le(self):
         return self._le
 
+    @property
+    def variant(self) -> str:
+        """
+        Variant predictions come from, fp32 until `optimize` accepts the configured one
+        """
+        return self._variant
+
     @torch.no_grad
     def predict(self, X: torch.Tensor) -> np.ndarray:
-        print(self.le.classes_)
         return self.le.inverse_transform(self.model(X).argmax(1))
 
+    @torch.no_grad
+    def predict_proba(self, X: torch.Tensor) -> np.ndarray:
+        return torch.softmax(self.model(X), 1).numpy()
+
+    def predict_with_proba(self, X: torch.Tensor) -> tuple[np.ndarray, np.ndarray]:
+        proba = self.predict_proba(X)
+        best = proba.argmax(1)
+        return self.le.inverse_transform(best), proba[np.arange(len(best)), best]
+
+    @staticmethod
+    def quantize_static(module: nn.Module, calibration: torch.Tensor) -> nn.Module:
+        example = calibration[:1].flatten(0, 1)
+        prepared = prepare_fx(
+            module, get_default_qconfig_mapping("x86"), example_inputs=(example,)
+        )
+        with torch.no_grad():
+            for X in calibration:
+                prepared(X)
+        return convert_fx(prepared)
+
+    @torch.no_grad
+    def optimize(self, calibration: torch.Tensor | None, min_agreement: float) -> float:
+        """
+        Replace the fp32 model with the configured variant
+
+        The variant is kept only if its labels agree with the fp32 model on at
+        least `min_agreement` of the calibration inputs. Without calibration
+        inputs static_int8 can not be built and the agreement can not be
+        checked, so fp32 is kept unless `min_agreement` is 0. dynamic_int8 and
+        compiled use the fp32 backbone as it is, the other variants copy it.
+
+        Args:
+            calibration (torch.Tensor | None): sample inputs [N, seq, 3, 224, 224]
+            min_agreement (float): minimum share of equal labels
+
+        Returns:
+            float: agreement of the variant with the fp32 model, NaN if unknown
+        """
+        options = set(self._requested.split("+")) - {"fp32"}
+        if not options:
+            return 1.0
+
+        if calibration is None and ("static_int8" in options or min_agreement > 0):
+            print(
+                f"WARNING: no calibration segments to check {self._requested}, "
+                "using fp32; set RGB_CALIBRATION_DIR"
+            )
+            return float("nan")
+
+        reference = self._model
+        if options & {"static_int8", "channels_last", "traced"}:
+            # these rewrite the convolution weights, so the variant gets its own
+            model = copy.deepcopy(reference)
+        else:
+            # the backbone is shared with the reference, weights shared between
+            # processes stay shared
+            model = copy.deepcopy(reference, {id(reference.resnet): reference.resnet})
+        if "dynamic_int8" in options:
+            # the head holds every linear layer of the model
+            model.fc = quantize_dynamic(model.fc, {nn.Linear}, dtype=torch.qint8)
+        if "static_int8" in options:
+            torch.backends.quantized.engine = "x86"
+            model.resnet = self.quantize_static(model.resnet, calibration)
+        if "channels_last" in options:
+            model = model.to(memory_format=torch.channels_last)
+        if "traced" in options:
+            example = (
+                calibration[:2]
+                if calibration is not None
+                else torch.zeros(2, 2, 3, 224, 224)
+            )
+            model = torch.jit.optimize_for_inference(
+                torch.jit.trace(model.eval(), example)
+            )
+        if "compiled" in options:
+            model = torch.compile(model, dynamic=True)
+
+        agreement = float("nan")
+        if calibration is not None:
+            agreement = float(
+                (reference(calibration).argmax(1) == model(calibration).argmax(1))
+                .float()
+                .mean()
+            )
+            print(f"{self._requested} agrees with fp32 on {agreement:.1%} of inputs")
+            if agreement < min_agreement:
+                print(f"WARNING: {self._requested} is not accurate enough, using fp32")
+                return agreement
+
+        self._model = model
+        self._variant = self._requested
+        return agreement
+
+    def share_memory(self) -> dict[str, torch.Tensor]:
+        """
+        Move the fp32 weights to shared memory, call before `optimize`
+
+        Returns:
+            dict[str, torch.Tensor]: state dict for `load_shared` in other processes
+        """
+        return {
+            name: tensor.share_memory_()
+            for name, tensor in self._model.state_dict().items()
+        }
+
+    def load_shared(self, state: dict[str, torch.Tensor], le: LabelEncoder) -> None:
+        """
+        Use weights shared by another process instead of copying them
+        """
+        self._model.load_state_dict(state, assign=True)
+        self._model.eval()
+        self._le = le
+
+    @torch.no_grad
+    def warmup(self, batch_sizes: list[int], seq_size: int = 2) -> None:
+        """
+        Run the model once per batch size so that the first query does not pay
+        for graph optimisation and kernel selection
+        """
+        for batch_size in batch_sizes:
+            self._model(torch.zeros(batch_size, seq_size, 3, 224, 224))
+
     def save(self, dir: str) -> None:
         dir = Path(dir)
 
@@ -173,6 +359,15 @@ class CatBoost(Model):
         X = self._scaler.transform(X)
         return self.model.predict_proba(X)
 
+    def predict_with_proba(self, X: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        proba = self.predict_proba(X)
+        best = proba.argmax(1)
+        labels = self.model.classes_[best]
+        return (
+            np.array([self.decode_label(label) for label in labels]),
+            proba[np.arange(len(best)), best],
+        )
+
     def save(self, dir: str) -> None:
         dir = Path(dir)
         with open(dir / "model.pkl", "wb") as f:
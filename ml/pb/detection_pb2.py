@@ -14,27 +14,33 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0f\x64\x65tection.proto\x12\tdetection\"D\n\x05Query\x12\n\n\x02id\x18\x01 \x01(\x03\x12\x0e\n\x06source\x18\x02 \x01(\t\x12\x1f\n\x05model\x18\x03 \x01(\x0e\x32\x10.detection.Model\"5\n\x08Response\x12)\n\x06status\x18\x01 \x01(\x0e\x32\x19.detection.ResponseStatus\"\x17\n\tResultReq\x12\n\n\x02id\x18\x01 \x01(\x03\"1\n\x07\x41nomaly\x12\n\n\x02ts\x18\x01 \x01(\x03\x12\r\n\x05links\x18\x02 \x03(\t\x12\x0b\n\x03\x63ls\x18\x03 \x01(\t\"3\n\nResultResp\x12%\n\tanomalies\x18\x01 \x03(\x0b\x32\x12.detection.Anomaly*\x1b\n\x05Model\x12\x07\n\x03Rgb\x10\x00\x12\t\n\x05\x42ytes\x10\x01*F\n\x0eResponseStatus\x12\x0e\n\nProcessing\x10\x00\x12\x0b\n\x07Success\x10\x01\x12\t\n\x05\x45rror\x10\x02\x12\x0c\n\x08\x43\x61nceled\x10\x03\x32|\n\tMlService\x12\x32\n\x07Process\x12\x10.detection.Query\x1a\x13.detection.Response\"\x00\x12;\n\nFindResult\x12\x14.detection.ResultReq\x1a\x15.detection.ResultResp\"\x00\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0f\x64\x65tection.proto\x12\tdetection\"U\n\x05Query\x12\n\n\x02id\x18\x01 \x01(\x03\x12\x0e\n\x06source\x18\x02 \x01(\t\x12\x1f\n\x05model\x18\x03 \x01(\x0e\x32\x10.detection.Model\x12\x0f\n\x07profile\x18\x04 \x01(\x08\"5\n\x08Response\x12)\n\x06status\x18\x01 \x01(\x0e\x32\x19.detection.ResponseStatus\"F\n\tResultReq\x12\n\n\x02id\x18\x01 \x01(\x03\x12\x0e\n\x06offset\x18\x02 \x01(\x05\x12\r\n\x05limit\x18\x03 \x01(\x05\x12\x0e\n\x06\x63ursor\x18\x04 \x01(\t\"1\n\x07\x41nomaly\x12\n\n\x02ts\x18\x01 \x01(\x03\x12\r\n\x05links\x18\x02 \x03(\t\x12\x0b\n\x03\x63ls\x18\x03 \x01(\t\"H\n\nResultResp\x12%\n\tanomalies\x18\x01 \x03(\x0b\x32\x12.detection.Anomaly\x12\x13\n\x0bnext_cursor\x18\x02 \x01(\t\"9\n\x08Progress\x12\x19\n\x11seconds_processed\x18\x01 \x01(\x03\x12\x12\n\nthroughput\x18\x02 \x01(\x01\"<\n\x0c\x41nomalyEvent\x12\n\n\x02ts\x18\x01 \x01(\x03\x12\x0b\n\x03\x63ls\x18\x02 \x01(\t\x12\x13\n\x0bprobability\x18\x03 \x01(\x02\"\x93\x01\n\x0cProcessEvent\x12\'\n\x08progress\x18\x01 \x01(\x0b\x32\x13.detection.ProgressH\x00\x12*\n\x07\x61nomaly\x18\x02 \x01(\x0b\x32\x17.detection.AnomalyEventH\x00\x12%\n\x06result\x18\x03 \x01(\x0b\x32\x13.detection.ResponseH\x00\x42\x07\n\x05\x65vent*\x1b\n\x05Model\x12\x07\n\x03Rgb\x10\x00\x12\t\n\x05\x42ytes\x10\x01*F\n\x0eResponseStatus\x12\x0e\n\nProcessing\x10\x00\x12\x0b\n\x07Success\x10\x01\x12\t\n\x05\x45rror\x10\x02\x12\x0c\n\x08\x43\x61nceled\x10\x03\x32\xbc\x01\n\tMlService\x12\x32\n\x07Process\x12\x10.detection.Query\x1a\x13.detection.Response\"\x00\x12>\n\rProcessStream\x12\x10.detection.Query\x1a\x17.detection.ProcessEvent\"\x00\x30\x01\x12;\n\nFindResult\x12\x14.detection.ResultReq\x1a\x15.detection.ResultResp\"\x00\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'detection_pb2', _globals)
 if _descriptor._USE_C_DESCRIPTORS == False:
   DESCRIPTOR._options = None
-  _globals['_MODEL']._serialized_start=284
-  _globals['_MODEL']._serialized_end=311
-  _globals['_RESPONSESTATUS']._serialized_start=313
-  _globals['_RESPONSESTATUS']._serialized_end=383
+  _globals['_MODEL']._serialized_start=640
+  _globals['_MODEL']._serialized_end=667
+  _globals['_RESPONSESTATUS']._serialized_start=669
+  _globals['_RESPONSESTATUS']._serialized_end=739
   _globals['_QUERY']._serialized_start=30
-  _globals['_QUERY']._serialized_end=98
-  _globals['_RESPONSE']._serialized_start=100
-  _globals['_RESPONSE']._serialized_end=153
-  _globals['_RESULTREQ']._serialized_start=155
-  _globals['_RESULTREQ']._serialized_end=178
-  _globals['_ANOMALY']._serialized_start=180
-  _globals['_ANOMALY']._serialized_end=229
-  _globals['_RESULTRESP']._serialized_start=231
-  _globals['_RESULTRESP']._serialized_end=282
-  _globals['_MLSERVICE']._serialized_start=385
-  _globals['_MLSERVICE']._serialized_end=509
+  _globals['_QUERY']._serialized_end=115
+  _globals['_RESPONSE']._serialized_start=117
+  _globals['_RESPONSE']._serialized_end=170
+  _globals['_RESULTREQ']._serialized_start=172
+  _globals['_RESULTREQ']._serialized_end=242
+  _globals['_ANOMALY']._serialized_start=244
+  _globals['_ANOMALY']._serialized_end=293
+  _globals['_RESULTRESP']._serialized_start=295
+  _globals['_RESULTRESP']._serialized_end=367
+  _globals['_PROGRESS']._serialized_start=369
+  _globals['_PROGRESS']._serialized_end=426
+  _globals['_ANOMALYEVENT']._serialized_start=428
+  _globals['_ANOMALYEVENT']._serialized_end=488
+  _globals['_PROCESSEVENT']._serialized_start=491
+  _globals['_PROCESSEVENT']._serialized_end=638
+  _globals['_MLSERVICE']._serialized_start=742
+  _globals['_MLSERVICE']._serialized_end=930
 # @@protoc_insertion_point(module_scope)
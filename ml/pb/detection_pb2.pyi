@@ -25,14 +25,16 @@ Error: ResponseStatus
 Canceled: ResponseStatus
 
 class Query(_message.Message):
-    __slots__ = ("id", "source", "model")
+    __slots__ = ("id", "source", "model", "profile")
     ID_FIELD_NUMBER: _ClassVar[int]
     SOURCE_FIELD_NUMBER: _ClassVar[int]
     MODEL_FIELD_NUMBER: _ClassVar[int]
+    PROFILE_FIELD_NUMBER: _ClassVar[int]
     id: int
     source: str
     model: Model
-    def __init__(self, id: _Optional[int] = ..., source: _Optional[str] = ..., model: _Optional[_Union[Model, str]] = ...) -> None: ...
+    profile: bool
+    def __init__(self, id: _Optional[int] = ..., source: _Optional[str] = ..., model: _Optional[_Union[Model, str]] = ..., profile: bool = ...) -> None: ...
 
 class Response(_message.Message):
     __slots__ = ("status",)
@@ -41,10 +43,16 @@ class Response(_message.Message):
     def __init__(self, status: _Optional[_Union[ResponseStatus, str]] = ...) -> None: ...
 
 class ResultReq(_message.Message):
-    __slots__ = ("id",)
+    __slots__ = ("id", "offset", "limit", "cursor")
     ID_FIELD_NUMBER: _ClassVar[int]
+    OFFSET_FIELD_NUMBER: _ClassVar[int]
+    LIMIT_FIELD_NUMBER: _ClassVar[int]
+    CURSOR_FIELD_NUMBER: _ClassVar[int]
     id: int
-    def __init__(self, id: _Optional[int] = ...) -> None: ...
+    offset: int
+    limit: int
+    cursor: str
+    def __init__(self, id: _Optional[int] = ..., offset: _Optional[int] = ..., limit: _Optional[int] = ..., cursor: _Optional[str] = ...) -> None: ...
 
 class Anomaly(_message.Message):
     __slots__ = ("ts", "links", "cls")
@@ -57,7 +65,37 @@ class Anomaly(_message.Message):
     def __init__(self, ts: _Optional[int] = ..., links: _Optional[_Iterable[str]] = ..., cls: _Optional[str] = ...) -> None: ...
 
 class ResultResp(_message.Message):
-    __slots__ = ("anomalies",)
+    __slots__ = ("anomalies", "next_cursor")
     ANOMALIES_FIELD_NUMBER: _ClassVar[int]
+    NEXT_CURSOR_FIELD_NUMBER: _ClassVar[int]
     anomalies: _containers.RepeatedCompositeFieldContainer[Anomaly]
-    def __init__(self, anomalies: _Optional[_Iterable[_Union[Anomaly, _Mapping]]] = ...) -> None: ...
+    next_cursor: str
+    def __init__(self, anomalies: _Optional[_Iterable[_Union[Anomaly, _Mapping]]] = ..., next_cursor: _Optional[str] = ...) -> None: ...
+
+class Progress(_message.Message):
+    __slots__ = ("seconds_processed", "throughput")
+    SECONDS_PROCESSED_FIELD_NUMBER: _ClassVar[int]
+    THROUGHPUT_FIELD_NUMBER: _ClassVar[int]
+    seconds_processed: int
+    throughput: float
+    def __init__(self, seconds_processed: _Optional[int] = ..., throughput: _Optional[float] = ...) -> None: ...
+
+class AnomalyEvent(_message.Message):
+    __slots__ = ("ts", "cls", "probability")
+    TS_FIELD_NUMBER: _ClassVar[int]
+    CLS_FIELD_NUMBER: _ClassVar[int]
+    PROBABILITY_FIELD_NUMBER: _ClassVar[int]
+    ts: int
+    cls: str
+    probability: float
+    def __init__(self, ts: _Optional[int] = ..., cls: _Optional[str] = ..., probability: _Optional[float] = ...) -> None: ...
+
+class ProcessEvent(_message.Message):
+    __slots__ = ("progress", "anomaly", "result")
+    PROGRESS_FIELD_NUMBER: _ClassVar[int]
+    ANOMALY_FIELD_NUMBER: _ClassVar[int]
+    RESULT_FIELD_NUMBER: _ClassVar[int]
+    progress: Progress
+    anomaly: AnomalyEvent
+    result: Response
+    def __init__(self, progress: _Optional[_Union[Progress, _Mapping]] = ..., anomaly: _Optional[_Union[AnomalyEvent, _Mapping]] = ..., result: _Optional[_Union[Response, _Mapping]] = ...) -> None: ...
@@ -19,6 +19,11 @@ class MlServiceStub(object):
             request_serializer=detection__pb2.Query.SerializeToString,
             response_deserializer=detection__pb2.Response.FromString,
         )
+        self.ProcessStream = channel.unary_stream(
+            "/detection.MlService/ProcessStream",
+            request_serializer=detection__pb2.Query.SerializeToString,
+            response_deserializer=detection__pb2.ProcessEvent.FromString,
+        )
         self.FindResult = channel.unary_unary(
             "/detection.MlService/FindResult",
             request_serializer=detection__pb2.ResultReq.SerializeToString,
@@ -35,6 +40,12 @@ class MlServiceServicer(object):
         context.set_details("Method not implemented!")
         raise NotImplementedError("Method not implemented!")
 
+    def ProcessStream(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
     def FindResult(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -49,6 +60,11 @@ def add_MlServiceServicer_to_server(servicer, server):
             request_deserializer=detection__pb2.Query.FromString,
             response_serializer=detection__pb2.Response.SerializeToString,
         ),
+        "ProcessStream": grpc.unary_stream_rpc_method_handler(
+            servicer.ProcessStream,
+            request_deserializer=detection__pb2.Query.FromString,
+            response_serializer=detection__pb2.ProcessEvent.SerializeToString,
+        ),
         "FindResult": grpc.unary_unary_rpc_method_handler(
             servicer.FindResult,
             request_deserializer=detection__pb2.ResultReq.FromString,
@@ -94,6 +110,35 @@ class MlService(object):
             metadata,
         )
 
+    @staticmethod
+    def ProcessStream(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            "/detection.MlService/ProcessStream",
+            detection__pb2.Query.SerializeToString,
+            detection__pb2.ProcessEvent.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
     @staticmethod
     def FindResult(
         request,
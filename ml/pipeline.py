@@ -0,0 +1,145 @@
+import asyncio
+from contextlib import aclosing, suppress
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+from metrics import IN_FLIGHT, QUEUE_DEPTH
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_DONE = object()
+
+
+async def batched(
+    items: AsyncIterator[T], size: int, max_wait: float
+) -> AsyncIterator[list[T]]:
+    """
+    Group consecutive items of async iterator into batches
+
+    Batch is emitted when it holds `size` items or when `max_wait` seconds passed
+    since its first item arrived, whichever comes first. Order of items is kept.
+
+    Args:
+        items (AsyncIterator[T]): source iterator
+        size (int): maximum batch size
+        max_wait (float): maximum time in seconds to hold incomplete batch
+
+    Yields:
+        list[T]: batch of consecutive items
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=size)
+
+    async def fill():
+        try:
+            async with aclosing(items):
+                async for item in items:
+                    await queue.put(item)
+        except Exception:
+            await queue.put(_DONE)
+            raise
+        await queue.put(_DONE)
+
+    filler = asyncio.create_task(fill())
+    try:
+        batch = []
+        deadline = 0.0
+        while True:
+            timeout = None if not batch else max(deadline - loop.time(), 0)
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except TimeoutError:
+                yield batch
+                batch = []
+                continue
+
+            if item is _DONE:
+                break
+
+            if not batch:
+                deadline = loop.time() + max_wait
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+        await filler
+    finally:
+        filler.cancel()
+        with suppress(asyncio.CancelledError):
+            await filler
+
+
+async def stage(
+    items: AsyncIterator[T],
+    fn: Callable[[T], Awaitable[R]],
+    concurrency: int,
+    queue_size: int,
+    name: str = "stage",
+) -> AsyncIterator[R]:
+    """
+    Apply async function to every item with bounded concurrency
+
+    Up to `queue_size` items are taken from the source ahead of the consumer and
+    at most `concurrency` calls of `fn` run at the same time. When the queue is
+    full the source is not read any further. Results are yielded in source order.
+    Closing the stage cancels its calls and closes the source.
+
+    Args:
+        items (AsyncIterator[T]): source iterator
+        fn (Callable[[T], Awaitable[R]]): stage function
+        concurrency (int): maximum number of concurrent calls
+        queue_size (int): maximum number of items taken ahead of the consumer
+        name (str): stage name in queue depth and in-flight metrics, shared by
+            the stages of concurrent queries
+
+    Yields:
+        R: results of `fn` in source order
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    pending = asyncio.Queue(maxsize=queue_size)
+    depth = QUEUE_DEPTH.labels(name)
+    in_flight = IN_FLIGHT.labels(name)
+
+    async def call(item: T) -> R:
+        async with semaphore:
+            with in_flight.track_inprogress():
+                return await fn(item)
+
+    async def fill():
+        try:
+            async with aclosing(items):
+                async for item in items:
+                    await pending.put(asyncio.create_task(call(item)))
+                    depth.inc()
+        except Exception as ex:
+            failed = loop.create_future()
+            failed.set_exception(ex)
+            await pending.put(failed)
+            depth.inc()
+        await pending.put(_DONE)
+
+    filler = asyncio.create_task(fill())
+    try:
+        while (task := await pending.get()) is not _DONE:
+            depth.dec()
+            yield await task
+    finally:
+        filler.cancel()
+        with suppress(asyncio.CancelledError):
+            await filler
+        while not pending.empty():
+            task = pending.get_nowait()
+            if task is not _DONE:
+                depth.dec()
+                task.cancel()
+
+
+async def unbatched(batches: AsyncIterator[list[T]]) -> AsyncIterator[T]:
+    async with aclosing(batches):
+        async for batch in batches:
+            for item in batch:
+                yield item
@@ -0,0 +1,167 @@
+import cProfile
+import functools
+import io
+import json
+import pstats
+import threading
+import time
+from contextlib import aclosing, contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import AsyncIterator, Callable, Iterator, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_current: ContextVar["QueryProfile | None"] = ContextVar("profile", default=None)
+
+
+def current_profile() -> "QueryProfile | None":
+    return _current.get()
+
+
+class QueryProfile:
+    """
+    Profile of one query
+
+    Collects a cProfile of every executor call made for the query, a timeline
+    of those calls and of ffmpeg segments in Chrome trace format and torch
+    profiler traces of the first inference batches. Nothing is collected for
+    queries without a profile.
+    """
+
+    def __init__(self, query_id: int, dir: str, torch_batches: int = 3) -> None:
+        self.dir = Path(dir) / str(query_id)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stats: pstats.Stats | None = None
+        self._events: list[dict] = []
+        self._torch_batches = torch_batches
+        self._torch_traces = 0
+
+    def span(self, name: str, start: float, end: float, thread: str, **args) -> None:
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": (start - self._origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": 0,
+            "tid": thread,
+            "args": args,
+        }
+        with self._lock:
+            self._events.append(event)
+
+    def call(self, name: str, fn: Callable[..., R], /, *args, **kwargs) -> R:
+        """
+        Run `fn` under cProfile and add it to the timeline, called in worker thread
+        """
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # python 3.12+ profiles all threads at once, one call at a time
+            profiler = None
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            end = time.perf_counter()
+            if profiler is not None:
+                profiler.disable()
+            self.span(name, start, end, threading.current_thread().name)
+            if profiler is not None:
+                with self._lock:
+                    if self._stats is None:
+                        self._stats = pstats.Stats(profiler)
+                    else:
+                        self._stats.add(profiler)
+
+    def torch(self, fn: Callable[..., R]) -> Callable[..., R]:
+        """
+        Wrap inference so that the first batches are recorded by torch profiler
+        """
+
+        @functools.wraps(fn)
+        def traced(*args, **kwargs) -> R:
+            with self._lock:
+                n = self._torch_traces
+                self._torch_traces += 1
+            if n >= self._torch_batches:
+                return fn(*args, **kwargs)
+
+            from torch.profiler import ProfilerActivity, profile
+
+            with profile(activities=[ProfilerActivity.CPU], record_shapes=True) as prof:
+                result = fn(*args, **kwargs)
+            prof.export_chrome_trace(str(self.dir / f"torch-{n}.json"))
+            return result
+
+        return traced
+
+    async def trace_items(self, items: AsyncIterator[T], name: str) -> AsyncIterator[T]:
+        """
+        Add the wait for every item of async iterator to the timeline
+        """
+        async with aclosing(items):
+            start = time.perf_counter()
+            async for item in items:
+                self.span(name, start, time.perf_counter(), "asyncio")
+                yield item
+                start = time.perf_counter()
+
+    def save(self, **meta) -> None:
+        """
+        Write the timeline and the cProfile report to `dir`, blocks on disk I/O
+        """
+        with self._lock:
+            events = list(self._events)
+            stats = self._stats
+
+        with open(self.dir / "timeline.json", "w") as f:
+            json.dump({"traceEvents": events, "metadata": meta}, f)
+        if stats is not None:
+            stats.dump_stats(self.dir / "profile.pstats")
+            report = io.StringIO()
+            stats.stream = report
+            stats.sort_stats("cumulative").print_stats(50)
+            (self.dir / "profile.txt").write_text(report.getvalue())
+
+
+@contextmanager
+def subprocess_span(name: str, command: list[str]) -> Iterator[None]:
+    """
+    Add a subprocess to the timeline of the profiled query, does nothing otherwise
+    """
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.span(
+            name,
+            start,
+            time.perf_counter(),
+            f"subprocess {threading.current_thread().name}",
+            command=" ".join(command),
+        )
+
+
+@contextmanager
+def profiled(profile: QueryProfile) -> Iterator[QueryProfile]:
+    """
+    Profile everything the current task and its children do for a query
+
+    The profile is not saved, writing it blocks, so the caller runs
+    `QueryProfile.save` in an executor once the query is done.
+    """
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
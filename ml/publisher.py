@@ -0,0 +1,43 @@
+import asyncio
+
+import aiokafka
+
+from metrics import KAFKA_IN_FLIGHT
+
+
+class Publisher:
+    """
+    Non-blocking Kafka sends with a bound on the number of messages in flight
+
+    `send` returns as soon as the message is queued in the producer batch, the
+    returned future resolves when the broker acknowledges it. When too many
+    messages are waiting for acknowledgement `send` waits for a free slot.
+    """
+
+    def __init__(self, producer: aiokafka.AIOKafkaProducer, max_in_flight: int) -> None:
+        self._producer = producer
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+
+    @property
+    def producer(self) -> aiokafka.AIOKafkaProducer:
+        return self._producer
+
+    async def send(
+        self, topic: str, value: bytes, key: bytes | None = None
+    ) -> asyncio.Future:
+        await self._in_flight.acquire()
+        try:
+            delivery = await self._producer.send(topic, value, key=key)
+        except BaseException:
+            self._in_flight.release()
+            raise
+
+        KAFKA_IN_FLIGHT.inc()
+        delivery.add_done_callback(self._delivered)
+        return delivery
+
+    def _delivered(self, delivery: asyncio.Future) -> None:
+        self._in_flight.release()
+        KAFKA_IN_FLIGHT.dec()
+        if not delivery.cancelled() and delivery.exception() is not None:
+            print(f"kafka delivery failed: {delivery.exception()}")
@@ -0,0 +1,115 @@
+from bisect import bisect_right
+from collections import OrderedDict, defaultdict
+
+import pymongo
+from pymongo.collection import Collection
+
+PROJECTION = {"_id": 0, "ts": 1, "cls": 1, "links": 1}
+
+
+def find_anomalies(col: Collection, query_id: int, batch_size: int) -> list[dict]:
+    """
+    Read anomalies of a query ordered by second, only the fields FindResult returns
+
+    The (query_id, ts) index is created by the responser, which owns the collection.
+    """
+    cursor = (
+        col.find({"query_id": query_id}, PROJECTION)
+        .sort("ts", pymongo.ASCENDING)
+        .batch_size(batch_size)
+    )
+    with cursor:
+        return list(cursor)
+
+
+def paginate(
+    anomalies: list[dict], offset: int, limit: int, cursor: str
+) -> tuple[list[dict], str]:
+    """
+    Take a page of anomalies ordered by second
+
+    Args:
+        anomalies (list[dict]): anomalies ordered by `ts`
+        offset (int): number of anomalies to skip
+        limit (int): maximum page size, 0 for no limit
+        cursor (str): `ts` of the last anomaly of the previous page, empty for the first page
+
+    Returns:
+        tuple[list[dict], str]: page and cursor of the next page, empty if it is the last one
+    """
+    start = offset
+    if cursor:
+        start += bisect_right(anomalies, int(cursor), key=lambda anomaly: anomaly["ts"])
+    end = start + limit if limit > 0 else len(anomalies)
+
+    page = anomalies[start:end]
+    next_cursor = str(page[-1]["ts"]) if page and end < len(anomalies) else ""
+    return page, next_cursor
+
+
+class ResultCache:
+    """
+    LRU cache of query results
+
+    Every invalidation bumps the generation of a query. A result read from the
+    database is stored only if the generation did not change while it was read,
+    so a result that raced with a write of the responser is never cached.
+
+    Invalidations come from the updates consumer. While it is paused nothing is
+    cached, since updates sent in the meantime would be missed.
+    """
+
+    def __init__(self, max_queries: int) -> None:
+        self._max_queries = max_queries
+        self._results: OrderedDict[int, list[dict]] = OrderedDict()
+        self._generations: defaultdict[int, int] = defaultdict(int)
+        # bumped by clear, invalidates reads of every query in flight
+        self._epoch = 0
+        self._paused = False
+
+    def get(self, query_id: int) -> list[dict] | None:
+        anomalies = self._results.get(query_id)
+        if anomalies is not None:
+            self._results.move_to_end(query_id)
+        return anomalies
+
+    def generation(self, query_id: int) -> tuple[int, int]:
+        return self._epoch, self._generations[query_id]
+
+    def put(
+        self, query_id: int, anomalies: list[dict], generation: tuple[int, int]
+    ) -> None:
+        if (
+            self._max_queries <= 0
+            or self._paused
+            or self.generation(query_id) != generation
+        ):
+            return
+
+        self._results[query_id] = anomalies
+        self._results.move_to_end(query_id)
+        while len(self._results) > self._max_queries:
+            self._results.popitem(last=False)
+
+    def invalidate(self, query_id: int) -> None:
+        self._generations[query_id] += 1
+        self._results.pop(query_id, None)
+
+    def clear(self) -> None:
+        self._epoch += 1
+        self._results.clear()
+        self._generations.clear()
+
+    def pause(self) -> None:
+        """
+        Stop caching and drop cached results, updates are no longer delivered
+        """
+        self._paused = True
+        self.clear()
+
+    def resume(self) -> None:
+        """
+        Start caching again, results cached before are dropped as they may be stale
+        """
+        self._paused = False
+        self.clear()
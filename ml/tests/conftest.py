@@ -0,0 +1,43 @@
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# modules of the service import each other by name, as in the container
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+@pytest.fixture(scope="session")
+def make_video(tmp_path_factory):
+    """
+    Write a test pattern video with ffmpeg: make_video(rate, seconds) -> path
+    """
+    if shutil.which("ffmpeg") is None:
+        pytest.skip("ffmpeg is not installed")
+    root = tmp_path_factory.mktemp("videos")
+
+    def make(rate: str, seconds: int) -> str:
+        path = root / f"{rate.replace('/', '_')}_{seconds}.mp4"
+        if not path.exists():
+            subprocess.run(
+                [
+                    "ffmpeg",
+                    "-loglevel",
+                    "error",
+                    "-f",
+                    "lavfi",
+                    "-i",
+                    f"testsrc=size=160x120:rate={rate}:duration={seconds}",
+                    "-c:v",
+                    "libx264",
+                    "-pix_fmt",
+                    "yuv420p",
+                    str(path),
+                ],
+                check=True,
+            )
+        return str(path)
+
+    return make
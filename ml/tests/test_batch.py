@@ -0,0 +1,47 @@
+import shutil
+
+import pytest
+
+from batch import collect_videos, plan
+
+
+def test_glob_keeps_only_videos(make_video, tmp_path):
+    shutil.copy(make_video("25", 3), tmp_path / "a.mp4")
+    shutil.copy(make_video("25", 3), tmp_path / "B.MP4")
+    (tmp_path / "notes.txt").write_text("not a video")
+    (tmp_path / "folder.mp4").mkdir()
+
+    videos = collect_videos(str(tmp_path / "*"), str(tmp_path))
+
+    assert [name.rsplit("/", 1)[-1] for name, _ in videos] == ["B.MP4", "a.mp4"]
+
+
+@pytest.mark.skipif(shutil.which("ffprobe") is None, reason="ffprobe is not installed")
+def test_unreadable_video_is_reported_not_planned(make_video, tmp_path):
+    broken = tmp_path / "broken.mp4"
+    broken.write_bytes(b"not a video")
+    videos = [
+        ("short.mp4", make_video("25", 3)),
+        ("broken.mp4", str(broken)),
+        ("long.mp4", make_video("25", 6)),
+    ]
+
+    chunks, failed = plan(videos, 2)
+
+    assert [(name, start, duration) for name, _, _, start, duration in chunks] == [
+        ("long.mp4", 0, 2),
+        ("long.mp4", 2, 2),
+        ("long.mp4", 4, 1),
+        ("short.mp4", 0, 2),
+    ]
+    assert [name for name, _ in failed] == ["broken.mp4"]
+    assert failed[0][1]
+
+
+def test_missing_prober_is_reported_per_video(monkeypatch):
+    monkeypatch.setenv("PATH", "")
+
+    chunks, failed = plan([("a.mp4", "a.mp4"), ("b.mp4", "b.mp4")], 2)
+
+    assert chunks == []
+    assert [name for name, _ in failed] == ["a.mp4", "b.mp4"]
@@ -0,0 +1,106 @@
+import os
+import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from cache import DiskCache
+
+VALUE = np.arange(100, dtype=np.int64)
+SIZE = len(pickle.dumps(VALUE, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def stored(tmp_path) -> set[str]:
+    return {path.stem for path in tmp_path.glob("*.pkl")}
+
+
+def test_round_trip(tmp_path):
+    cache = DiskCache(tmp_path, 10 * SIZE)
+    cache.put("a", (VALUE, "label", 0.5))
+
+    value, label, proba = cache.get("a")
+
+    np.testing.assert_array_equal(value, VALUE)
+    assert (label, proba) == ("label", 0.5)
+    assert cache.get("missing") is None
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = DiskCache(tmp_path, 2 * SIZE)
+    cache.put("a", VALUE)
+    cache.put("b", VALUE)
+    cache.get("a")
+
+    cache.put("c", VALUE)
+
+    assert stored(tmp_path) == {"a", "c"}
+    assert cache.get("b") is None
+
+
+def test_value_larger_than_cache_is_not_stored(tmp_path):
+    cache = DiskCache(tmp_path, SIZE - 1)
+    cache.put("a", VALUE)
+
+    assert cache.get("a") is None and stored(tmp_path) == set()
+
+
+def test_overwrite_is_counted_once(tmp_path):
+    cache = DiskCache(tmp_path, 2 * SIZE)
+    for _ in range(3):
+        cache.put("a", VALUE)
+    cache.put("b", VALUE)
+
+    assert stored(tmp_path) == {"a", "b"}
+
+
+def test_recency_survives_restart(tmp_path):
+    cache = DiskCache(tmp_path, 2 * SIZE)
+    cache.put("a", VALUE)
+    cache.put("b", VALUE)
+    # "a" was read last before the restart
+    os.utime(tmp_path / "a.pkl", (2_000_000_000, 2_000_000_000))
+    os.utime(tmp_path / "b.pkl", (1_000_000_000, 1_000_000_000))
+    (tmp_path / "c.0123.tmp").write_bytes(b"interrupted write")
+
+    cache = DiskCache(tmp_path, 2 * SIZE)
+    cache.put("c", VALUE)
+
+    assert stored(tmp_path) == {"a", "c"}
+    assert list(tmp_path.glob("*.tmp")) == []
+
+
+def test_concurrent_puts_stay_within_bounds(tmp_path):
+    cache = DiskCache(tmp_path, 8 * SIZE)
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda i: cache.put(f"k{i % 20}", VALUE), range(200)))
+
+    assert len(stored(tmp_path)) <= 8
+    assert sum(path.stat().st_size for path in tmp_path.glob("*.pkl")) <= 8 * SIZE
+    for key in stored(tmp_path):
+        np.testing.assert_array_equal(cache.get(key), VALUE)
+
+
+def test_evicted_key_put_again_concurrently_is_kept(tmp_path, monkeypatch):
+    # three keys in room for two: every put evicts a key another thread puts again,
+    # slow deletes give the other threads time to do it
+    unlink = Path.unlink
+
+    def slow_unlink(path, *args, **kwargs):
+        time.sleep(0.001)
+        unlink(path, *args, **kwargs)
+
+    monkeypatch.setattr(Path, "unlink", slow_unlink)
+    cache = DiskCache(tmp_path, 2 * SIZE)
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda i: cache.put(f"k{i % 3}", VALUE), range(600)))
+
+    assert len(stored(tmp_path)) == 2
+    for key in stored(tmp_path):
+        np.testing.assert_array_equal(cache.get(key), VALUE)
+    # a new entry evicts exactly one of them, so the size kept matches the disk
+    cache.put("new", VALUE)
+    assert len(stored(tmp_path)) == 2 and "new" in stored(tmp_path)
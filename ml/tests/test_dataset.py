@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.stats as stats
+from scipy.signal import medfilt
+
+from dataset import ResNetProcess, SignalProcess
+from video import save_bin
+
+
+def reference_features(y: np.ndarray) -> list[float]:
+    # the per-signal features prepare_batch replaced, in SignalProcess.FEATURES order
+    rms = np.sqrt(np.mean(y**2))
+    peak = np.max(np.abs(y))
+    return [
+        np.min(y),
+        np.max(y),
+        np.mean(y),
+        rms,
+        np.var(y),
+        np.std(y),
+        np.mean(y**2),
+        peak,
+        np.ptp(y),
+        peak / rms,
+        stats.skew(y, nan_policy="omit"),
+        stats.kurtosis(y),
+        rms / np.mean(y),
+        peak / np.mean(y),
+    ]
+
+
+def assert_features(actual: np.ndarray, rows: list[np.ndarray]) -> None:
+    expected = np.array([reference_features(row) for row in rows], dtype=np.float32)
+    np.testing.assert_allclose(actual, expected, rtol=1e-5)
+
+
+@pytest.fixture
+def signals() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return rng.integers(1, 1000, size=(8, 256)).astype(np.float64)
+
+
+def test_prepare_batch_matches_reference(signals):
+    features = SignalProcess().prepare_batch(signals)
+
+    assert features.dtype == np.float32 and features.flags.c_contiguous
+    assert_features(features, list(signals))
+
+
+def test_median_filter_matches_medfilt(signals):
+    features = SignalProcess(median_filter=True).prepare_batch(signals)
+
+    assert_features(features, [medfilt(row, kernel_size=35) for row in signals])
+
+
+def test_denoize_drops_quiet_values(signals):
+    signals[:, :20] = 1
+    features = SignalProcess(denoize=True).prepare_batch(signals)
+
+    rows = [row[np.abs(row) > 0.05 * np.abs(row).max()] for row in signals]
+    assert_features(features, rows)
+
+
+def test_prepare_from_bytes_matches_value_counts():
+    rng = np.random.default_rng(1)
+    # a few byte values never occur and must not count as zeros
+    data = rng.integers(0, 200, size=10_000, dtype=np.uint8).tobytes()
+
+    frame = SignalProcess().prepare_from_bytes(data)
+
+    counts = pd.Series(np.frombuffer(data, dtype="uint8")).value_counts().sort_index()
+    assert list(frame.columns) == SignalProcess.FEATURES
+    assert_features(frame.to_numpy(), [counts.values.astype(np.float64)])
+
+
+def test_constant_signal_has_undefined_moments():
+    features = SignalProcess().prepare_batch(np.full((1, 16), 7.0))
+
+    skew, kurtosis = features[0, 10:12]
+    assert np.isnan(skew) and np.isnan(kurtosis)
+
+
+def test_calibration_set_reads_saved_segments(make_video, tmp_path):
+    src = make_video("25", 3)
+    for idx in range(2):
+        save_bin(src, str(tmp_path), idx, 25)
+
+    calibration = ResNetProcess().calibration_set(str(tmp_path), 8)
+
+    assert calibration.shape == (2, 2, 3, 224, 224)
+
+
+def test_calibration_set_without_segments(tmp_path):
+    assert ResNetProcess().calibration_set(str(tmp_path), 8) is None
+    assert ResNetProcess().calibration_set(None, 8) is None
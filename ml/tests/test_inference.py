@@ -0,0 +1,41 @@
+import asyncio
+import os
+import signal
+
+import torch
+from prometheus_client import REGISTRY
+
+from inference import InferencePool
+from model import CatBoost, DLModel
+
+
+def test_pool_is_rebuilt_after_a_worker_dies():
+    model = DLModel()
+    model.le.fit(CatBoost().classes)
+    X = torch.randn(1, 2, 3, 224, 224)
+
+    async def run() -> tuple:
+        pool = InferencePool(model, CatBoost(), "fp32", 1, 1, None, 0.98, [1])
+        try:
+            await pool.start()
+            expected = await pool.predict("Rgb", X)
+            killed = pool.pids
+
+            os.kill(killed[0], signal.SIGKILL)
+            restarts = REGISTRY.get_sample_value("ml_inference_restarts_total")
+            labels, probas = await pool.predict("Rgb", X)
+
+            assert REGISTRY.get_sample_value("ml_inference_restarts_total") == (
+                restarts + 1
+            )
+            assert pool.pids != killed
+            return expected, (labels, probas)
+        finally:
+            pool.shutdown()
+
+    (expected_labels, expected_probas), (labels, probas) = asyncio.run(
+        asyncio.wait_for(run(), 120)
+    )
+
+    assert list(labels) == list(expected_labels)
+    torch.testing.assert_close(torch.tensor(probas), torch.tensor(expected_probas))
@@ -0,0 +1,75 @@
+import asyncio
+from contextlib import aclosing
+
+from prometheus_client import REGISTRY
+
+from live import LagStats, drop_stale
+from pipeline import batched, stage, unbatched
+
+INTERVAL = 0.02
+MAX_AGE = 0.3
+BATCH = 4
+BATCH_TIME = 0.2
+
+
+async def camera(seconds: int):
+    # a live source does not wait for the consumer
+    for idx in range(seconds):
+        yield idx, b"segment"
+        await asyncio.sleep(INTERVAL)
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_late_windows_are_dropped_downstream():
+    lags = []
+    before = [
+        sample("ml_live_lag_seconds_count"),
+        sample("ml_live_dropped_total", reason="overflow"),
+        sample("ml_live_dropped_total", reason="late"),
+    ]
+
+    async def run() -> LagStats:
+        lag = LagStats(MAX_AGE)
+
+        async def prepare(segment):
+            await asyncio.sleep(0.001)
+            return segment
+
+        async def infer(batch):
+            # inference is ten times slower than the camera
+            await asyncio.sleep(BATCH_TIME)
+            return batch
+
+        async def publish(prediction):
+            if not lag.on_time(prediction[0]):
+                return None
+            lag.done(prediction[0])
+            lags.append(lag.last_lag)
+            return prediction
+
+        prepared = stage(drop_stale(camera(150), 4, lag), prepare, 2, 4)
+        predicted = stage(
+            batched(prepared, BATCH, 0.05), lambda batch: infer(lag.fresh(batch)), 1, 4
+        )
+        published = stage(unbatched(predicted), publish, 1, 4)
+        async with aclosing(published):
+            async for _ in published:
+                pass
+        return lag
+
+    lag = asyncio.run(run())
+
+    assert lag.processed > 0 and lag.dropped > 0
+    assert lag.processed + lag.dropped == lag.received
+    assert max(lags) <= MAX_AGE + BATCH_TIME
+
+    published, overflow, late = [
+        sample("ml_live_lag_seconds_count") - before[0],
+        sample("ml_live_dropped_total", reason="overflow") - before[1],
+        sample("ml_live_dropped_total", reason="late") - before[2],
+    ]
+    assert published == lag.processed
+    assert overflow + late == lag.dropped and late > 0
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+import torch
+
+from model import DLModel, proba_agreement
+
+
+def test_proba_agreement_uses_tolerance():
+    reference = np.array([[0.9, 0.1], [0.55, 0.45], [0.2, 0.8], [0.5, 0.5]])
+    # both the second and the third rows flip the label, only the third moves far
+    other = np.array([[0.85, 0.15], [0.45, 0.55], [0.6, 0.4], [0.5, 0.5]])
+
+    assert proba_agreement(reference, other, 0.15) == 0.75
+    assert proba_agreement(reference, other, 0.5) == 1.0
+
+
+def test_nan_probabilities_never_agree():
+    reference = np.array([[0.9, 0.1], [0.2, 0.8]])
+    other = np.array([[np.nan, np.nan], [0.2, 0.8]])
+
+    assert proba_agreement(reference, other, 1.0) == 0.5
+
+
+@pytest.fixture(scope="module")
+def calibration() -> torch.Tensor:
+    torch.manual_seed(0)
+    return torch.randn(4, 2, 3, 224, 224)
+
+
+def test_fp32_until_optimized():
+    assert DLModel("dynamic_int8").variant == "fp32"
+
+
+def test_variant_is_kept_when_it_agrees(calibration):
+    model = DLModel("dynamic_int8")
+
+    agreement = model.optimize(calibration, 0.5)
+
+    assert agreement >= 0.5
+    assert model.variant == "dynamic_int8"
+
+
+def test_inaccurate_variant_falls_back_to_fp32(calibration, capsys):
+    model = DLModel("dynamic_int8")
+
+    model.optimize(calibration, 1.1)
+
+    assert model.variant == "fp32"
+    assert "WARNING" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("variant", ["static_int8", "channels_last"])
+def test_no_calibration_falls_back_to_fp32(variant, capsys):
+    model = DLModel(variant)
+
+    assert np.isnan(model.optimize(None, 0.98))
+    assert model.variant == "fp32"
+    assert "no calibration segments" in capsys.readouterr().out
+
+
+def test_no_calibration_without_agreement_check():
+    model = DLModel("channels_last")
+
+    model.optimize(None, 0.0)
+
+    assert model.variant == "channels_last"
+
+
+@pytest.mark.parametrize(
+    "variant", ["dynamic_int8", "compiled", "dynamic_int8+compiled"]
+)
+def test_variant_keeps_shared_backbone(variant):
+    # as in an inference worker: weights shared by the parent, then optimized
+    parent = DLModel()
+    model = DLModel(variant)
+    model.load_shared(parent.share_memory(), parent.le)
+
+    model.optimize(None, 0.0)
+
+    assert model.variant == variant
+    optimized = getattr(model.model, "_orig_mod", model.model)
+    assert all(param.is_shared() for param in optimized.resnet.parameters())
+    assert all(buffer.is_shared() for buffer in optimized.resnet.buffers())
@@ -0,0 +1,48 @@
+import asyncio
+from contextlib import aclosing
+
+from prometheus_client import REGISTRY
+
+from pipeline import stage
+
+
+def depth() -> float:
+    return REGISTRY.get_sample_value("ml_queue_depth", {"stage": "shared"}) or 0.0
+
+
+async def numbers(count: int):
+    for i in range(count):
+        yield i
+
+
+def test_queue_depth_is_summed_over_queries_and_released():
+    async def slow(i: int) -> int:
+        await asyncio.sleep(0.05)
+        return i
+
+    async def query(count: int, take: int) -> list[int]:
+        taken = []
+        results = stage(numbers(count), slow, 1, 4, "shared")
+        async with aclosing(results):
+            async for i in results:
+                taken.append(i)
+                if len(taken) == take:
+                    break
+        return taken
+
+    async def main() -> float:
+        first = asyncio.create_task(query(10, 10))
+        # closed after two results with items still queued
+        second = asyncio.create_task(query(10, 2))
+        await asyncio.sleep(0.01)
+        # both queues are refilled while the first items are being processed
+        waiting = depth()
+        assert await first == list(range(10))
+        assert await second == [0, 1]
+        return waiting
+
+    before = depth()
+    waiting = asyncio.run(main())
+
+    assert waiting - before == 8
+    assert depth() == before
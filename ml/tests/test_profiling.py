@@ -0,0 +1,39 @@
+import asyncio
+import json
+import time
+
+from executors import run_cpu, run_io
+from profiling import QueryProfile, current_profile, profiled
+
+
+def test_profile_records_executor_calls_and_saves_off_loop(tmp_path, capsys):
+    async def query() -> QueryProfile:
+        profile = QueryProfile(7, tmp_path)
+        with profiled(profile):
+            await run_io(time.sleep, 0.01)
+            await run_cpu(sum, range(1000))
+        assert current_profile() is None
+        await run_io(profile.save, query_id=7, model="Rgb")
+        return profile
+
+    profile = asyncio.run(query())
+
+    timeline = json.loads((profile.dir / "timeline.json").read_text())
+    assert {event["name"] for event in timeline["traceEvents"]} == {"sleep", "sum"}
+    assert timeline["metadata"] == {"query_id": 7, "model": "Rgb"}
+    assert (profile.dir / "profile.pstats").exists()
+    assert "cumulative" in (profile.dir / "profile.txt").read_text()
+    # logging is left to the service
+    assert capsys.readouterr().out == ""
+
+
+def test_other_tasks_are_not_profiled(tmp_path):
+    async def main() -> None:
+        profile = QueryProfile(1, tmp_path)
+        with profiled(profile):
+            inside = asyncio.create_task(run_io(current_profile))
+        outside = asyncio.create_task(run_io(current_profile))
+        assert await inside is profile
+        assert await outside is None
+
+    asyncio.run(main())
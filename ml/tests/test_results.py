@@ -0,0 +1,96 @@
+from results import ResultCache, paginate
+
+ANOMALIES = [{"ts": ts, "cls": "blur"} for ts in (1, 2, 5, 8, 13, 21)]
+
+
+def read_pages(limit: int, offset: int = 0) -> list[list[int]]:
+    pages, cursor = [], ""
+    while True:
+        page, cursor = paginate(ANOMALIES, offset if not pages else 0, limit, cursor)
+        pages.append([anomaly["ts"] for anomaly in page])
+        if not cursor:
+            return pages
+
+
+def test_cursor_walks_every_page():
+    assert read_pages(4) == [[1, 2, 5, 8], [13, 21]]
+    assert read_pages(3) == [[1, 2, 5], [8, 13, 21]]
+    assert read_pages(2, offset=1) == [[2, 5], [8, 13], [21]]
+
+
+def test_no_limit_returns_everything():
+    page, cursor = paginate(ANOMALIES, 0, 0, "")
+
+    assert page == ANOMALIES and cursor == ""
+
+
+def test_cursor_is_a_second_not_a_position():
+    # a second inserted before the cursor does not shift the next page
+    anomalies = sorted([*ANOMALIES, {"ts": 3, "cls": "crop"}], key=lambda a: a["ts"])
+
+    page, cursor = paginate(anomalies, 0, 2, "5")
+
+    assert [anomaly["ts"] for anomaly in page] == [8, 13]
+    assert cursor == "13"
+
+
+def test_cursor_past_the_end():
+    assert paginate(ANOMALIES, 0, 2, "21") == ([], "")
+
+
+def test_result_is_cached_when_generation_is_unchanged():
+    cache = ResultCache(2)
+    generation = cache.generation(1)
+    cache.put(1, ANOMALIES, generation)
+
+    assert cache.get(1) is ANOMALIES
+
+
+def test_result_read_during_invalidation_is_not_cached():
+    cache = ResultCache(2)
+    generation = cache.generation(1)
+    cache.invalidate(1)
+    cache.put(1, ANOMALIES, generation)
+
+    assert cache.get(1) is None
+    cache.put(1, ANOMALIES, cache.generation(1))
+    assert cache.get(1) is ANOMALIES
+
+
+def test_invalidation_drops_only_its_query():
+    cache = ResultCache(2)
+    cache.put(1, ANOMALIES, cache.generation(1))
+    cache.put(2, ANOMALIES, cache.generation(2))
+
+    cache.invalidate(1)
+
+    assert cache.get(1) is None and cache.get(2) is ANOMALIES
+
+
+def test_least_recently_used_is_evicted():
+    cache = ResultCache(2)
+    for query_id in (1, 2):
+        cache.put(query_id, ANOMALIES, cache.generation(query_id))
+    cache.get(1)
+    cache.put(3, ANOMALIES, cache.generation(3))
+
+    assert cache.get(2) is None
+    assert cache.get(1) is ANOMALIES and cache.get(3) is ANOMALIES
+
+
+def test_nothing_is_cached_while_paused():
+    cache = ResultCache(2)
+    cache.put(1, ANOMALIES, cache.generation(1))
+    generation = cache.generation(2)
+
+    cache.pause()
+    assert cache.get(1) is None
+    cache.put(2, ANOMALIES, cache.generation(2))
+    assert cache.get(2) is None
+
+    cache.resume()
+    # read that started before the consumer stopped may have missed an update
+    cache.put(2, ANOMALIES, generation)
+    assert cache.get(2) is None
+    cache.put(2, ANOMALIES, cache.generation(2))
+    assert cache.get(2) is ANOMALIES
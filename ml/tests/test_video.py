@@ -0,0 +1,98 @@
+import asyncio
+import sys
+from io import BytesIO
+
+import av
+import numpy as np
+import pytest
+
+import video
+from video import SPS_START_CODE, packet_histograms, segment_stream
+
+
+def read_segments(src: str, fps: int, duration=None, start=0) -> list:
+    async def read():
+        return [segment async for segment in segment_stream(src, fps, duration, start)]
+
+    return asyncio.run(read())
+
+
+def count_frames(data: bytes) -> int:
+    with av.open(BytesIO(data), format="h264") as container:
+        return sum(1 for _ in container.decode(video=0))
+
+
+@pytest.mark.parametrize("rate, fps", [("25", 25), ("30000/1001", 29)])
+def test_segments_follow_seconds(make_video, rate, fps):
+    segments = read_segments(make_video(rate, 6), fps)
+
+    assert [idx for idx, _ in segments] == list(range(6))
+    for _, data in segments:
+        assert data.startswith(SPS_START_CODE)
+        # every segment decodes on its own and holds one second of frames
+        assert count_frames(data) in (fps, fps + 1)
+
+
+def test_segments_match_packet_seconds(make_video):
+    src = make_video("30000/1001", 6)
+
+    segments = read_segments(src, 29)
+    packets = list(packet_histograms(src))
+
+    assert [idx for idx, _ in segments] == [idx for idx, _ in packets]
+
+
+def test_start_and_duration(make_video):
+    segments = read_segments(make_video("25", 6), 25, duration=2, start=3)
+
+    assert [idx for idx, _ in segments] == [3, 4]
+    assert all(count_frames(data) == 25 for _, data in segments)
+
+
+def test_failed_ffmpeg_raises(tmp_path):
+    with pytest.raises(RuntimeError, match="ffmpeg segmenter failed"):
+        read_segments(str(tmp_path / "missing.mp4"), 25)
+
+
+def test_noisy_ffmpeg_does_not_stall(monkeypatch):
+    # far more log than a pipe holds, written before any video
+    script = (
+        "import sys\n"
+        "for i in range(20000): sys.stderr.write(f'warning {i}\\n')\n"
+        "sys.stderr.flush()\n"
+        f"sys.stdout.buffer.write({SPS_START_CODE * 2!r})\n"
+        "sys.exit(1)\n"
+    )
+    monkeypatch.setattr(
+        video, "segment_command", lambda *args: [sys.executable, "-c", script]
+    )
+
+    async def read():
+        return [segment async for segment in segment_stream("rtsp://camera", 25)]
+
+    with pytest.raises(RuntimeError) as failed:
+        asyncio.run(asyncio.wait_for(read(), 10))
+
+    # only the tail of the log is kept
+    assert "warning 19999" in str(failed.value)
+    assert "warning 0\n" not in str(failed.value)
+
+
+def test_seconds_without_packets_are_skipped(tmp_path):
+    # frames of seconds 2 and 3 are missing, e.g. a camera that stopped sending
+    path = tmp_path / "gap.mp4"
+    with av.open(str(path), "w") as container:
+        stream = container.add_stream("libx264", rate=25)
+        stream.width, stream.height, stream.pix_fmt = 160, 120, "yuv420p"
+        for pts in [*range(0, 50), *range(100, 150)]:
+            frame = av.VideoFrame.from_ndarray(
+                np.full((120, 160, 3), pts, dtype=np.uint8), format="rgb24"
+            )
+            frame.pts = pts
+            container.mux(stream.encode(frame))
+        container.mux(stream.encode())
+
+    packets = list(packet_histograms(str(path)))
+
+    assert [idx for idx, _ in packets] == [0, 1, 4, 5]
+    assert all(hist.any() for _, hist in packets)
@@ -1,6 +1,29 @@
+import asyncio
 import subprocess
+from collections import deque
+from contextlib import suppress
+from typing import AsyncIterator, Iterator
 
+import av
 import ffmpeg
+import numpy as np
+
+from profiling import subprocess_span
+
+# lines of ffmpeg log kept for the error message of a failed segmenter
+STDERR_TAIL_LINES = 20
+
+
+async def _tail(stream: asyncio.StreamReader, lines: deque[bytes]) -> None:
+    while True:
+        try:
+            line = await stream.readline()
+        except ValueError:
+            # a line longer than the stream buffer is skipped
+            continue
+        if not line:
+            return
+        lines.append(line)
 
 
 def save_bin(src: str, out: str, idx: int, fps: int):
@@ -35,6 +58,168 @@ def save_bin(src: str, out: str, idx: int, fps: int):
         .overwrite_output()
         .compile()
     )
-    subprocess.run(command)
+    with subprocess_span("save_bin", command):
+        subprocess.run(command)
 
     return bin_name
+
+
+SPS_START_CODE = b"\x00\x00\x00\x01\x67"
+
+
+def segment_command(
+    src: str, fps: int, duration: int | None = None, start: int = 0
+) -> list[str]:
+    # a keyframe at every whole second of the output timeline, so segments follow
+    # real seconds for fractional framerates too (29.97 fps has 29 or 30 frames
+    # per second); no other keyframes since a GOP never reaches 2 * fps frames
+    output_kwargs = {
+        "vcodec": "libx264",
+        "format": "h264",
+        "force_key_frames": "expr:gte(t,n_forced*1)",
+        "forced-idr": 1,
+        "g": 2 * fps + 2,
+        "sc_threshold": 0,
+        "x264-params": "repeat-headers=1",
+        "loglevel": "error",
+    }
+    if duration is not None:
+        output_kwargs["t"] = duration
+
+    input_kwargs = {}
+    if src.startswith("rtsp"):
+        input_kwargs = {"rtsp_transport": "tcp", "fflags": "nobuffer"}
+    elif start:
+        input_kwargs = {"ss": start}
+
+    return (
+        ffmpeg.input(src, **input_kwargs)
+        .video.output("pipe:", **output_kwargs)
+        .compile()
+    )
+
+
+async def segment_stream(
+    src: str, fps: int, duration: int | None = None, start: int = 0
+) -> AsyncIterator[tuple[int, bytes]]:
+    """
+    Split video into one-second h264 segments with a single ffmpeg process
+
+    The source is opened once and re-encoded to an h264 pipe with a closed GOP
+    for every second of the timeline that starts with its own SPS/PPS, so every
+    GOP is an independently decodable one-second segment. Nothing is written to disk and
+    ffmpeg stalls on the pipe when the consumer falls behind. Its log is read as it
+    comes, so a long live stream never stalls on a full stderr pipe, and the last
+    lines are kept for the error.
+
+    Args:
+        src (str): path or url of the video
+        fps (int): framerate of the video
+        duration (int | None): number of seconds to read, whole video if None
+        start (int): second of a video file to start from
+
+    Yields:
+        tuple[int, bytes]: second index and raw h264 segment
+    """
+    command = segment_command(src, fps, duration, start)
+    proc = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stderr: deque[bytes] = deque(maxlen=STDERR_TAIL_LINES)
+    reader = asyncio.create_task(_tail(proc.stderr, stderr))
+    with subprocess_span("segment_stream", command):
+        try:
+            idx = start
+            buffer = bytearray()
+            while chunk := await proc.stdout.read(1 << 16):
+                search_from = max(len(buffer) - len(SPS_START_CODE), 1)
+                buffer += chunk
+                while (end := buffer.find(SPS_START_CODE, search_from)) != -1:
+                    yield idx, bytes(buffer[:end])
+                    del buffer[:end]
+                    idx += 1
+                    search_from = 1
+
+            if buffer:
+                yield idx, bytes(buffer)
+
+            await reader
+            if await proc.wait() != 0:
+                log = b"".join(stderr).decode("utf-8", errors="replace")
+                raise RuntimeError(f"ffmpeg segmenter failed: {log}")
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            reader.cancel()
+            with suppress(asyncio.CancelledError):
+                await reader
+
+
+def extract_segment(src: str, idx: int, fps: int) -> bytes:
+    """
+    Re-encode one second of video to h264 in memory
+
+    Args:
+        src (str): path or url of the video
+        idx (int): second to extract
+        fps (int): framerate of the video
+
+    Returns:
+        bytes: raw h264 segment
+    """
+    stream = ffmpeg.input(src, ss=idx).video.output(
+        "pipe:", format="h264", vframes=fps, loglevel="error"
+    )
+    with subprocess_span("extract_segment", stream.compile()):
+        data, _ = stream.run(capture_stdout=True)
+    return data
+
+
+def packet_histograms(
+    src: str, duration: int | None = None
+) -> Iterator[tuple[int, np.ndarray]]:
+    """
+    Count byte values of the compressed video packets for every second
+
+    Packets are demuxed as they are stored in the source, nothing is decoded or
+    re-encoded. Packets are assigned to seconds by their decoding timestamp,
+    seconds without packets are not yielded.
+
+    Args:
+        src (str): path or url of the video
+        duration (int | None): number of seconds to read, whole video if None
+
+    Yields:
+        tuple[int, np.ndarray]: second index and 256-bin byte histogram
+    """
+    with av.open(src) as container:
+        stream = container.streams.video[0]
+        start = stream.start_time or 0
+
+        idx = 0
+        hist = np.zeros(256, dtype=np.int64)
+        for packet in container.demux(stream):
+            ts = packet.dts if packet.dts is not None else packet.pts
+            if ts is None or packet.size == 0:
+                continue
+
+            second = max(int((ts - start) * stream.time_base), 0)
+            if duration is not None and second >= duration:
+                break
+
+            if second > idx:
+                # a second without packets has no features, it is skipped
+                if hist.any():
+                    yield idx, hist
+                idx = second
+                hist = np.zeros(256, dtype=np.int64)
+
+            hist += np.bincount(
+                np.frombuffer(bytes(packet), dtype="uint8"), minlength=256
+            )
+
+        if hist.any():
+            yield idx, hist
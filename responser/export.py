@@ -0,0 +1,217 @@
+import math
+import threading
+from fractions import Fraction
+from io import BytesIO
+
+import av
+import cv2
+import numpy as np
+
+from metrics import STAGE_SECONDS
+
+SELECTIONS = ("all", "first_middle_last", "top")
+MODES = ("frames", "clip", "sprite")
+
+
+class FrameExporter:
+    """
+    Decode anomaly segment in memory and encode selected frames to JPEG exactly once
+
+    Frame selection:
+        all: every frame
+        first_middle_last: first, middle and last frame
+        top: `count` frames that look most anomalous by a cheap score, the least
+            sharp frames for blur, the brightest for highlight and the frames
+            that differ most from the rest of the second for other classes
+
+    Export modes:
+        frames: one JPEG per selected frame
+        clip: one MP4 with the segment stream-copied, no re-encode
+        sprite: one JPEG with selected frames tiled `columns` per row, each
+            resized to `tile_width`
+
+    Thumbnails are resized into a per-thread buffer that is reused between
+    frames of the same size.
+    """
+
+    def __init__(
+        self,
+        quality: int = 75,
+        thumbnail_width: int = 0,
+        thumbnail_quality: int = 70,
+        selection: str = "all",
+        count: int = 3,
+        mode: str = "frames",
+        tile_width: int = 320,
+        columns: int = 5,
+    ) -> None:
+        assert selection in SELECTIONS
+        assert mode in MODES
+        self.mode = mode
+        self._tile_width = tile_width
+        self._columns = columns
+        self._selection = selection
+        self._count = count
+        self._params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        self._thumbnail_width = thumbnail_width
+        self._thumbnail_params = [cv2.IMWRITE_JPEG_QUALITY, thumbnail_quality]
+        self._local = threading.local()
+
+    @staticmethod
+    def decode(data: bytes, limit: int) -> list[np.ndarray]:
+        frames = []
+        with av.open(BytesIO(data), format="h264") as container:
+            for frame in container.decode(video=0):
+                frames.append(frame.to_ndarray(format="bgr24"))
+                if len(frames) == limit:
+                    break
+        return frames
+
+    @staticmethod
+    def scores(frames: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+        sharpness, brightness = [], []
+        for frame in frames:
+            height, width = frame.shape[:2]
+            small = cv2.resize(
+                frame,
+                (160, max(height * 160 // width, 1)),
+                interpolation=cv2.INTER_AREA,
+            )
+            gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+            sharpness.append(cv2.Laplacian(gray, cv2.CV_32F).var())
+            brightness.append(gray.mean())
+        return np.array(sharpness), np.array(brightness)
+
+    def select(self, frames: list[np.ndarray], label: str) -> list[int]:
+        n = len(frames)
+        if self._selection == "all" or n <= self._count:
+            return list(range(n))
+
+        if self._selection == "first_middle_last":
+            return sorted({0, (n - 1) // 2, n - 1})
+
+        sharpness, brightness = self.scores(frames)
+        if label == "blur":
+            score = -sharpness
+        elif label == "highlight":
+            score = brightness
+        else:
+            score = sum(
+                np.abs(x - x.mean()) / (x.std() + 1e-6) for x in (sharpness, brightness)
+            )
+        return sorted(np.argsort(-score, kind="stable")[: self._count].tolist())
+
+    def encode(self, frame: np.ndarray) -> bytes:
+        with STAGE_SECONDS.labels("jpeg_encode").time():
+            return cv2.imencode(".jpg", frame, self._params)[1].tobytes()
+
+    def thumbnail(self, frame: np.ndarray) -> bytes | None:
+        if not self._thumbnail_width:
+            return None
+
+        height, width = frame.shape[:2]
+        size = (self._thumbnail_width, height * self._thumbnail_width // width)
+        buffer = getattr(self._local, "thumbnail", None)
+        if buffer is None or buffer.shape[:2] != size[::-1]:
+            buffer = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            self._local.thumbnail = buffer
+
+        cv2.resize(frame, size, dst=buffer, interpolation=cv2.INTER_AREA)
+        return cv2.imencode(".jpg", buffer, self._thumbnail_params)[1].tobytes()
+
+    @staticmethod
+    def clip(data: bytes, fps: int) -> bytes:
+        """
+        Remux raw h264 segment into MP4 without re-encoding
+
+        Raw h264 carries no timestamps and may contain B-frames, so packets are
+        decoded once to learn display order. Decode index is used as DTS and
+        display index shifted by the reorder delay as PTS.
+        """
+        time_base = Fraction(1, fps)
+        buffer = BytesIO()
+        with av.open(BytesIO(data), format="h264") as src, av.open(
+            buffer,
+            mode="w",
+            format="mp4",
+            options={"movflags": "frag_keyframe+empty_moov+default_base_moof"},
+        ) as dst:
+            packets = [packet for packet in src.demux(video=0) if packet.size]
+            decoder = src.streams.video[0].codec_context
+            shown = []
+            for i, packet in enumerate(packets):
+                packet.pts = packet.dts = i
+                packet.time_base = time_base
+                shown.extend(frame.pts for frame in decoder.decode(packet))
+            shown.extend(frame.pts for frame in decoder.decode(None))
+
+            display = {i: j for j, i in enumerate(shown)}
+            delay = max((i - j for i, j in display.items()), default=0)
+            stream = dst.add_stream_from_template(src.streams.video[0])
+            stream.time_base = time_base
+            for i, packet in enumerate(packets):
+                if i not in display:
+                    continue
+                packet.pts = display[i] + delay
+                packet.dts = i
+                packet.duration = 1
+                packet.stream = stream
+                dst.mux(packet)
+        return buffer.getvalue()
+
+    def sprite(self, frames: list[np.ndarray]) -> bytes:
+        height, width = frames[0].shape[:2]
+        tile_height = max(height * self._tile_width // width, 1)
+        columns = min(self._columns, len(frames))
+        rows = math.ceil(len(frames) / columns)
+        sheet = np.zeros(
+            (rows * tile_height, columns * self._tile_width, 3), dtype=np.uint8
+        )
+        for i, frame in enumerate(frames):
+            y, x = divmod(i, columns)
+            cv2.resize(
+                frame,
+                (self._tile_width, tile_height),
+                dst=sheet[
+                    y * tile_height : (y + 1) * tile_height,
+                    x * self._tile_width : (x + 1) * self._tile_width,
+                ],
+                interpolation=cv2.INTER_AREA,
+            )
+        return self.encode(sheet)
+
+    def export(
+        self, data: bytes, fps: int, label: str
+    ) -> tuple[list[tuple[str, str, bytes]], bytes | None]:
+        """
+        Export one-second segment in the configured mode
+
+        Args:
+            data (bytes): raw h264 segment
+            fps (int): framerate of the segment
+            label (str): anomaly class
+
+        Returns:
+            tuple[list[tuple[str, str, bytes]], bytes | None]: object name
+            suffixes with their content type and content, and JPEG thumbnail of
+            the first selected frame if thumbnails are enabled
+        """
+        if self.mode == "clip":
+            thumbnail = None
+            if self._thumbnail_width:
+                frames = self.decode(data, 1)
+                thumbnail = self.thumbnail(frames[0]) if frames else None
+            return [(".mp4", "video/mp4", self.clip(data, fps))], thumbnail
+
+        frames = self.decode(data, fps - 1)
+        if not frames:
+            return [], None
+
+        selected = self.select(frames, label)
+        thumbnail = self.thumbnail(frames[selected[0]])
+        if self.mode == "sprite":
+            sprite = self.sprite([frames[i] for i in selected])
+            return [("_sprite.jpg", "image/jpeg", sprite)], thumbnail
+        return [
+            (f"_{i}.jpg", "image/jpeg", self.encode(frames[i])) for i in selected
+        ], thumbnail
@@ -1,16 +1,18 @@
 import aiokafka
 import asyncio
 import os
+from typing import Awaitable, Callable, TypeVar
 import pymongo
-import cv2
-import numpy as np
-import json
-import tempfile
-import base64
 from minio import Minio
+from prometheus_client import start_http_server
 from dotenv import load_dotenv
-from PIL import Image
-from io import BytesIO
+
+from export import FrameExporter
+from metrics import MESSAGES, PENDING_WRITES, QUEUE_DEPTH, STAGE_SECONDS
+from message import decode_anomaly
+from offsets import CommitOnRevoke, OffsetTracker
+from uploader import Uploader
+from writer import AnomalyWriter, WriteRejected, ensure_indexes
 
 
 load_dotenv(".env")
@@ -26,76 +28,221 @@ s3 = Minio(
     access_key=os.getenv("ACCESS_KEY"),
     secret_key=os.getenv("SECRET_KEY"),
     secure=True,
+    region=os.getenv("S3_REGION"),
 )
 
 
+# partitions are spread over workers, each handles its messages in order
+MESSAGE_WORKERS = int(os.getenv("MESSAGE_WORKERS", 4))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", 8))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 16))
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", 3))
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 100))
+WRITE_BATCH_WAIT = float(os.getenv("WRITE_BATCH_WAIT_MS", 500)) / 1000
+MAX_PENDING_WRITES = int(os.getenv("MAX_PENDING_WRITES", 2 * WRITE_BATCH_SIZE))
+CONSUMER_GROUP = os.getenv("CONSUMER_GROUP", "responser")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9101))
+# failed uploads and announcements are retried until they succeed, the partition waits
+RETRY_BACKOFF = float(os.getenv("RETRY_BACKOFF_MS", 500)) / 1000
+RETRY_MAX_BACKOFF = float(os.getenv("RETRY_MAX_BACKOFF_MS", 30000)) / 1000
+# ml service drops cached results of query ids published here
+UPDATES_TOPIC = os.getenv("UPDATES_TOPIC", "anomalies-updates")
+
+exporter = FrameExporter(
+    quality=int(os.getenv("JPEG_QUALITY", 75)),
+    thumbnail_width=int(os.getenv("THUMBNAIL_WIDTH", 0)),
+    thumbnail_quality=int(os.getenv("THUMBNAIL_QUALITY", 70)),
+    selection=os.getenv("FRAME_SELECTION", "first_middle_last"),
+    count=int(os.getenv("FRAME_COUNT", 3)),
+    mode=os.getenv("EXPORT_MODE", "frames"),
+    tile_width=int(os.getenv("SPRITE_TILE_WIDTH", 320)),
+    columns=int(os.getenv("SPRITE_COLUMNS", 5)),
+)
+
+T = TypeVar("T")
+
+
+async def retrying(what: str, fn: Callable[..., Awaitable[T]], *args, **kwargs) -> T:
+    """
+    Await `fn` until it succeeds, backing off between attempts
+    """
+    backoff = RETRY_BACKOFF
+    while True:
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as ex:
+            print(f"Failed to {what}, retrying in {backoff:.1f}s: {ex}")
+            MESSAGES.labels("retried").inc()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, RETRY_MAX_BACKOFF)
+
+
+def skip_poison(msg: aiokafka.ConsumerRecord, ex: Exception) -> None:
+    # the message can never be handled, its offset is committed to move past it
+    print(f"Skipping poison message {msg.topic}/{msg.partition}/{msg.offset}: {ex!r}")
+    MESSAGES.labels("poison").inc()
+
+
+async def upload(
+    value: dict,
+    objects: list[tuple[str, str, bytes]],
+    thumbnail: bytes | None,
+    uploader: Uploader,
+) -> dict:
+    idx = value["idx"]
+    query_id = value["query_id"]
+    uploads = [
+        uploader.put(f"{query_id}/{idx}{suffix}", content, content_type)
+        for suffix, content_type, content in objects
+    ]
+    if thumbnail is not None:
+        uploads.append(
+            uploader.put(f"{query_id}/{idx}_thumb.jpg", thumbnail, "image/jpeg")
+        )
+    links = await asyncio.gather(*uploads)
+    thumbnail_link = links.pop() if thumbnail is not None else None
+    print(f"Uploaded {len(links)} {exporter.mode} objects of {query_id}/{idx}")
+
+    anomaly = {
+        "query_id": query_id,
+        "ts": idx,
+        "cls": value["cls"],
+        "cnt": len(links),
+        "links": links,
+        "format": exporter.mode,
+    }
+    if thumbnail_link is not None:
+        anomaly["thumbnail"] = thumbnail_link
+    return anomaly
+
+
+async def handle(msg: aiokafka.ConsumerRecord, uploader: Uploader) -> dict | None:
+    """
+    Export and upload the frames of an anomaly message
+
+    Returns:
+        dict | None: anomaly document, None for a poison message that can not
+        be decoded or exported
+    """
+    print(f"Received message: {msg.offset} {msg.key}")
+    try:
+        value = decode_anomaly(msg.value)
+        print(f"fps = {value['fps']}")
+        with STAGE_SECONDS.labels("export").time():
+            objects, thumbnail = await asyncio.to_thread(
+                exporter.export, value["data"], value["fps"], value["cls"]
+            )
+    except Exception as ex:
+        skip_poison(msg, ex)
+        return None
+
+    return await retrying(
+        f"upload message {msg.offset}", upload, value, objects, thumbnail, uploader
+    )
+
+
+async def store(
+    anomaly: dict, writer: AnomalyWriter, producer: aiokafka.AIOKafkaProducer
+) -> None:
+    await writer.write(anomaly)
+    print(f"Inserted anomaly {anomaly['query_id']}/{anomaly['ts']}_{anomaly['cnt']}")
+    key = str(anomaly["query_id"]).encode()
+    await retrying(
+        f"announce anomaly {anomaly['query_id']}/{anomaly['ts']}",
+        producer.send,
+        UPDATES_TOPIC,
+        key,
+        key=key,
+    )
+
+
 async def main():
+    # values are decoded by the workers, so a malformed one is skipped as poison
     consumer = aiokafka.AIOKafkaConsumer(
-        "anomalies",
         bootstrap_servers=os.getenv("KAFKA_HOST"),
-        value_deserializer=lambda v: json.loads(v.decode("utf-8")),
+        group_id=CONSUMER_GROUP,
+        enable_auto_commit=False,
     )
+    producer = aiokafka.AIOKafkaProducer(bootstrap_servers=os.getenv("KAFKA_HOST"))
+    uploader = Uploader(s3, "detection-frame", UPLOAD_WORKERS, UPLOAD_RETRIES)
+    writer = AnomalyWriter(col, WRITE_BATCH_SIZE, WRITE_BATCH_WAIT)
+    offsets = OffsetTracker()
+    committing = asyncio.Lock()
+    queues = [asyncio.Queue(WORKER_QUEUE_SIZE) for _ in range(MESSAGE_WORKERS)]
+    writes = asyncio.Semaphore(MAX_PENDING_WRITES)
+    stores = set()
+
+    async def commit() -> None:
+        # messages finish out of order, commit only what is stored up to the offset
+        async with committing:
+            positions = offsets.take()
+            if not positions:
+                return
+            try:
+                await consumer.commit(positions)
+            except Exception as ex:
+                print(f"Failed to commit offsets: {ex}")
+
+    async def persist(
+        msg: aiokafka.ConsumerRecord, tp: aiokafka.TopicPartition, anomaly: dict
+    ) -> None:
+        try:
+            with PENDING_WRITES.track_inprogress():
+                await store(anomaly, writer, producer)
+            MESSAGES.labels("stored").inc()
+        except WriteRejected as ex:
+            skip_poison(msg, ex)
+        finally:
+            writes.release()
+        offsets.done(tp, msg.offset)
+        await commit()
+
+    async def work(worker: int, queue: asyncio.Queue) -> None:
+        # messages of a partition always go to the same worker and are handled in
+        # order, a message that keeps failing holds the partitions of its worker
+        depth = QUEUE_DEPTH.labels(str(worker))
+        while True:
+            msg = await queue.get()
+            depth.set(queue.qsize())
+            tp = aiokafka.TopicPartition(msg.topic, msg.partition)
+            with STAGE_SECONDS.labels("message").time():
+                anomaly = await handle(msg, uploader)
+            if anomaly is None:
+                offsets.done(tp, msg.offset)
+                await commit()
+                continue
+
+            # the next message is handled while this one waits for the batch flush
+            await writes.acquire()
+            task = asyncio.create_task(persist(msg, tp, anomaly))
+            stores.add(task)
+            task.add_done_callback(stores.discard)
 
+    start_http_server(METRICS_PORT)
+    consumer.subscribe(["anomalies"], listener=CommitOnRevoke(offsets, commit))
+    await asyncio.to_thread(ensure_indexes, col)
+    writer.start()
+    await producer.start()
     await consumer.start()
+    workers = [
+        asyncio.create_task(work(worker, queue)) for worker, queue in enumerate(queues)
+    ]
     try:
         async for msg in consumer:
-            with tempfile.TemporaryDirectory() as tmpdirname:
-                print(f"Received message: {msg.offset} {msg.key}")
-                idx = msg.value["idx"]
-                fps = msg.value["fps"]
-                query_id = msg.value["query_id"]
-                label = msg.value["cls"]
-                data = base64.b64decode(msg.value["data"])
-
-                with open(f"{tmpdirname}/anomaly_frames_{query_id}.h264", "wb") as f:
-                    f.write(data)
-
-                cap = cv2.VideoCapture(f"{tmpdirname}/anomaly_frames_{query_id}.h264")
-                cnt = 0
-                total_frames_uploaded = 0
-                print(f"fps = {fps}")
-                while cnt < fps - 1:
-                    _, raw = cap.read()
-                    # if cnt == 0 or cnt == fps - 2 or cnt == (fps - 1) // 2:
-                    frame = cv2.cvtColor(raw, cv2.IMREAD_COLOR)
-                    img = np.array(
-                        Image.open(BytesIO(cv2.imencode(".jpg", frame)[1].tobytes()))
-                    )
-                    data = BytesIO()
-                    Image.fromarray(img).save(data, "JPEG")
-                    data.seek(0)
-                    s3.put_object(
-                        "detection-frame",
-                        f"{query_id}/{idx}_{total_frames_uploaded}.jpg",
-                        data,
-                        length=len(data.getvalue()),
-                        content_type="image/jpeg",
-                    )
-                    print(f"Uploaded {query_id}/{idx}_{total_frames_uploaded}.jpg")
-                    total_frames_uploaded += 1
-                    cnt += 1
-
-                links = []
-                for i in range(total_frames_uploaded):
-                    links.append(
-                        s3.presigned_get_object(
-                            "detection-frame", f"{query_id}/{idx}_{i}.jpg"
-                        )
-                    )
-
-                col.insert_one(
-                    {
-                        "query_id": query_id,
-                        "ts": idx,
-                        "cls": label,
-                        "cnt": total_frames_uploaded,
-                        "links": links,
-                    }
-                )
-                print(f"Inserted anomaly {query_id}/{idx}_{total_frames_uploaded}")
+            tp = aiokafka.TopicPartition(msg.topic, msg.partition)
+            offsets.start(tp, msg.offset)
+            worker = hash(tp) % len(queues)
+            await queues[worker].put(msg)
+            QUEUE_DEPTH.labels(str(worker)).set(queues[worker].qsize())
 
     finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, *stores, return_exceptions=True)
+        await writer.close()
         await consumer.stop()
+        await producer.stop()
+        uploader.shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,49 @@
+import base64
+import json
+import struct
+
+MAGIC = b"ANM1"
+# magic, version, codec, idx, fps, query_id, length of cls
+HEADER = struct.Struct("<4sBBqiqH")
+
+CODECS = {0: "none", 1: "zstd", 2: "lz4"}
+
+
+def decompress(data: bytes, compression: str) -> bytes:
+    if compression == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data)
+    if compression == "lz4":
+        import lz4.frame
+
+        return lz4.frame.decompress(data)
+    return data
+
+
+def decode_anomaly(value: bytes) -> dict:
+    """
+    Unpack anomaly message produced by the ML service
+
+    Both the binary format and the legacy base64 JSON format are accepted.
+
+    Args:
+        value (bytes): kafka message value
+
+    Returns:
+        dict: idx, cls, fps, query_id and raw h264 segment in data
+    """
+    if not value.startswith(MAGIC):
+        msg = json.loads(value.decode("utf-8"))
+        msg["data"] = base64.b64decode(msg["data"])
+        return msg
+
+    _, _, codec, idx, fps, query_id, cls_len = HEADER.unpack_from(value)
+    cls_end = HEADER.size + cls_len
+    return {
+        "idx": idx,
+        "cls": value[HEADER.size : cls_end].decode("utf-8"),
+        "fps": fps,
+        "query_id": query_id,
+        "data": decompress(value[cls_end:], CODECS[codec]),
+    }
@@ -0,0 +1,28 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+STAGE_SECONDS = Histogram(
+    "responser_stage_seconds",
+    "Time spent in a stage of anomaly handling",
+    ["stage"],
+    buckets=BUCKETS,
+)
+MESSAGES = Counter("responser_messages_total", "Anomaly messages handled", ["result"])
+UPLOADS_IN_FLIGHT = Gauge("responser_uploads_in_flight", "S3 uploads running now")
+UPLOAD_RETRIES = Counter("responser_upload_retries_total", "Retried S3 uploads")
+WRITE_BUFFER = Gauge(
+    "responser_write_buffer", "Anomaly documents waiting for the bulk write"
+)
+WRITE_BATCH = Histogram(
+    "responser_write_batch_size",
+    "Documents per bulk write",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500),
+)
+QUEUE_DEPTH = Gauge(
+    "responser_queue_depth", "Messages waiting for an ordered worker", ["worker"]
+)
+PENDING_WRITES = Gauge(
+    "responser_pending_writes",
+    "Handled messages waiting for their document to be stored",
+)
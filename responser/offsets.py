@@ -0,0 +1,72 @@
+from typing import Awaitable, Callable
+
+from aiokafka import ConsumerRebalanceListener, TopicPartition
+
+
+class OffsetTracker:
+    """
+    Offsets that are safe to commit when messages finish out of order
+
+    For every partition the committed position is the offset after the last
+    message such that all messages before it are done.
+    """
+
+    def __init__(self) -> None:
+        self._started: dict[TopicPartition, list[int]] = {}
+        self._done: dict[TopicPartition, set[int]] = {}
+
+    def start(self, tp: TopicPartition, offset: int) -> None:
+        self._started.setdefault(tp, []).append(offset)
+        self._done.setdefault(tp, set())
+
+    def done(self, tp: TopicPartition, offset: int) -> None:
+        # partition may have been revoked while the message was processed
+        if tp in self._done:
+            self._done[tp].add(offset)
+
+    def take(self) -> dict[TopicPartition, int]:
+        """
+        Advance positions over finished messages
+
+        Returns:
+            dict[TopicPartition, int]: partitions whose position moved, with the
+            new position to commit
+        """
+        moved = {}
+        for tp, started in self._started.items():
+            done = self._done[tp]
+            i = 0
+            while i < len(started) and started[i] in done:
+                done.discard(started[i])
+                i += 1
+            if i:
+                moved[tp] = started[i - 1] + 1
+                del started[:i]
+        return moved
+
+    def forget(self, partitions: set[TopicPartition]) -> None:
+        for tp in partitions:
+            self._started.pop(tp, None)
+            self._done.pop(tp, None)
+
+
+class CommitOnRevoke(ConsumerRebalanceListener):
+    """
+    Commit finished messages of partitions that move to another consumer
+
+    Messages of revoked partitions that are still in progress are not committed,
+    the new owner processes them again and the idempotent write keeps one copy.
+    """
+
+    def __init__(
+        self, offsets: OffsetTracker, commit: Callable[[], Awaitable[None]]
+    ) -> None:
+        self._offsets = offsets
+        self._commit = commit
+
+    async def on_partitions_revoked(self, revoked: set[TopicPartition]) -> None:
+        await self._commit()
+        self._offsets.forget(revoked)
+
+    async def on_partitions_assigned(self, assigned: set[TopicPartition]) -> None:
+        pass
@@ -0,0 +1,50 @@
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# modules of the service import each other by name, as in the container
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# main builds its clients at import, none of them connects before it is used
+for name, value in {
+    "S3_HOST": "localhost:9000",
+    "MONGO_HOST": "localhost",
+    "MONGO_PORT": "27017",
+    "MONGO_DB": "test",
+}.items():
+    os.environ.setdefault(name, value)
+
+
+@pytest.fixture(scope="session")
+def segment():
+    """
+    One second of raw h264 at 25 fps with B-frames, as the ML service sends it
+    """
+    if shutil.which("ffmpeg") is None:
+        pytest.skip("ffmpeg is not installed")
+    return subprocess.run(
+        [
+            "ffmpeg",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc=size=160x120:rate=25:duration=1",
+            "-c:v",
+            "libx264",
+            "-pix_fmt",
+            "yuv420p",
+            "-bf",
+            "2",
+            "-f",
+            "h264",
+            "-",
+        ],
+        check=True,
+        capture_output=True,
+    ).stdout
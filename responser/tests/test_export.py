@@ -0,0 +1,23 @@
+from fractions import Fraction
+from io import BytesIO
+
+import av
+import pytest
+
+from export import FrameExporter
+
+
+def test_clip_lasts_one_second(segment):
+    clip = FrameExporter.clip(segment, 25)
+
+    with av.open(BytesIO(clip)) as container:
+        stream = container.streams.video[0]
+        packets = [packet for packet in container.demux(stream) if packet.size]
+        assert container.duration / av.time_base == pytest.approx(1)
+        # every sample, the last one included, lasts one frame
+        assert {packet.duration * stream.time_base for packet in packets} == {
+            Fraction(1, 25)
+        }
+
+    with av.open(BytesIO(clip)) as container:
+        assert sum(1 for _ in container.decode(video=0)) == 25
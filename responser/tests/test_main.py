@@ -0,0 +1,94 @@
+import asyncio
+import base64
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from export import FrameExporter
+
+
+class RecordingUploader:
+    def __init__(self, failures: int = 0) -> None:
+        self.failures = failures
+        self.objects = {}
+
+    async def put(self, name: str, data: bytes, content_type: str) -> str:
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("s3 is down")
+        self.objects[name] = (content_type, data)
+        return f"https://s3/{name}"
+
+
+def message(value: bytes) -> SimpleNamespace:
+    return SimpleNamespace(
+        topic="anomalies", partition=0, offset=0, key=b"7", value=value
+    )
+
+
+def anomaly_message(segment: bytes) -> SimpleNamespace:
+    return message(
+        json.dumps(
+            {
+                "idx": 3,
+                "fps": 25,
+                "query_id": 7,
+                "cls": "blur",
+                "data": base64.b64encode(segment).decode("utf-8"),
+            }
+        ).encode("utf-8")
+    )
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(main, "RETRY_BACKOFF", 0)
+
+
+@pytest.mark.parametrize(
+    "mode, names, content_type",
+    [
+        ("clip", ["7/3.mp4"], "video/mp4"),
+        ("sprite", ["7/3_sprite.jpg"], "image/jpeg"),
+        ("frames", ["7/3_0.jpg", "7/3_11.jpg", "7/3_23.jpg"], "image/jpeg"),
+    ],
+)
+def test_handle_uploads_every_mode(monkeypatch, segment, mode, names, content_type):
+    monkeypatch.setattr(
+        main, "exporter", FrameExporter(mode=mode, selection="first_middle_last")
+    )
+    uploader = RecordingUploader()
+
+    anomaly = asyncio.run(main.handle(anomaly_message(segment), uploader))
+
+    assert sorted(uploader.objects) == names
+    assert {kind for kind, _ in uploader.objects.values()} == {content_type}
+    assert anomaly["format"] == mode
+    assert anomaly["links"] == [f"https://s3/{name}" for name in names]
+
+
+def test_failed_upload_is_retried(monkeypatch, segment):
+    monkeypatch.setattr(main, "exporter", FrameExporter(mode="clip"))
+    uploader = RecordingUploader(failures=2)
+
+    anomaly = asyncio.run(main.handle(anomaly_message(segment), uploader))
+
+    assert anomaly["links"] == ["https://s3/7/3.mp4"]
+
+
+@pytest.mark.parametrize("value", [b"not a message", b'{"idx": 3}'])
+def test_undecodable_message_is_poison(value):
+    uploader = RecordingUploader()
+
+    assert asyncio.run(main.handle(message(value), uploader)) is None
+    assert uploader.objects == {}
+
+
+def test_segment_that_can_not_be_exported_is_poison(monkeypatch):
+    monkeypatch.setattr(main, "exporter", FrameExporter(mode="clip"))
+
+    msg = anomaly_message(b"\x00\x00\x00\x01\x67 not h264")
+
+    assert asyncio.run(main.handle(msg, RecordingUploader())) is None
@@ -0,0 +1,70 @@
+import base64
+import importlib.util
+import json
+from pathlib import Path
+
+import pytest
+
+import message
+from message import decode_anomaly
+
+# the ML service has its own `message` module, load it under another name
+spec = importlib.util.spec_from_file_location(
+    "ml_message", Path(__file__).resolve().parents[2] / "ml" / "message.py"
+)
+ml_message = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(ml_message)
+
+SEGMENT = b"\x00\x00\x00\x01\x67" + bytes(range(256)) * 8
+
+
+@pytest.mark.parametrize("compression", ["none", "zstd", "lz4"])
+def test_binary_round_trip(compression):
+    value = ml_message.encode_anomaly(12, "размытие", 30, 2**40, SEGMENT, compression)
+
+    assert decode_anomaly(value) == {
+        "idx": 12,
+        "cls": "размытие",
+        "fps": 30,
+        "query_id": 2**40,
+        "data": SEGMENT,
+    }
+
+
+def test_compression_shrinks_segment():
+    plain = ml_message.encode_anomaly(0, "blur", 25, 1, SEGMENT, "none")
+    packed = ml_message.encode_anomaly(0, "blur", 25, 1, SEGMENT, "zstd")
+
+    assert len(packed) < len(plain)
+
+
+def test_empty_segment():
+    value = ml_message.encode_anomaly(0, "blur", 25, 1, b"")
+
+    assert decode_anomaly(value)["data"] == b""
+
+
+def test_legacy_json():
+    value = json.dumps(
+        {
+            "idx": 3,
+            "cls": "crop",
+            "fps": 25,
+            "query_id": 7,
+            "data": base64.b64encode(SEGMENT).decode("utf-8"),
+        }
+    ).encode("utf-8")
+
+    assert decode_anomaly(value) == {
+        "idx": 3,
+        "cls": "crop",
+        "fps": 25,
+        "query_id": 7,
+        "data": SEGMENT,
+    }
+
+
+def test_codec_ids_match():
+    assert message.MAGIC == ml_message.MAGIC
+    assert message.HEADER.format == ml_message.HEADER.format
+    assert {v: k for k, v in message.CODECS.items()} == ml_message.CODECS
@@ -0,0 +1,71 @@
+import asyncio
+
+from aiokafka import TopicPartition
+
+from offsets import CommitOnRevoke, OffsetTracker
+
+TP0 = TopicPartition("anomalies", 0)
+TP1 = TopicPartition("anomalies", 1)
+
+
+def started(*offsets: int, tp: TopicPartition = TP0) -> OffsetTracker:
+    tracker = OffsetTracker()
+    for offset in offsets:
+        tracker.start(tp, offset)
+    return tracker
+
+
+def test_position_follows_finished_prefix():
+    tracker = started(10, 11, 12)
+
+    tracker.done(TP0, 11)
+    assert tracker.take() == {}
+
+    tracker.done(TP0, 10)
+    assert tracker.take() == {TP0: 12}
+
+    tracker.done(TP0, 12)
+    assert tracker.take() == {TP0: 13}
+    assert tracker.take() == {}
+
+
+def test_gaps_in_offsets_are_allowed():
+    # compacted topics and transaction markers leave holes between offsets
+    tracker = started(3, 7, 20)
+    for offset in (20, 3, 7):
+        tracker.done(TP0, offset)
+
+    assert tracker.take() == {TP0: 21}
+
+
+def test_partitions_move_independently():
+    tracker = started(0, 1)
+    tracker.start(TP1, 5)
+    tracker.done(TP1, 5)
+    tracker.done(TP0, 1)
+
+    assert tracker.take() == {TP1: 6}
+
+
+def test_revoked_partition_is_forgotten():
+    tracker = started(0, 1)
+    tracker.forget({TP0})
+
+    # a message of the revoked partition finishes late
+    tracker.done(TP0, 0)
+    assert tracker.take() == {}
+
+
+def test_commit_on_revoke_commits_before_forgetting():
+    tracker = started(0, 1)
+    tracker.done(TP0, 0)
+    committed = []
+
+    async def commit() -> None:
+        committed.append(tracker.take())
+
+    asyncio.run(CommitOnRevoke(tracker, commit).on_partitions_revoked({TP0}))
+
+    assert committed == [{TP0: 1}]
+    tracker.done(TP0, 1)
+    assert tracker.take() == {}
@@ -0,0 +1,69 @@
+import asyncio
+
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from writer import DUPLICATE_KEY, AnomalyWriter, WriteRejected
+
+
+class FlakyCollection:
+    """
+    Collection that fails the first bulk writes and refuses some seconds
+    """
+
+    def __init__(self, failures: int = 0, refused: set[int] = frozenset()) -> None:
+        self.failures = failures
+        self.refused = refused
+        self.docs = {}
+
+    def bulk_write(self, requests: list, ordered: bool) -> None:
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect("primary stepped down")
+
+        errors = []
+        for i, request in enumerate(requests):
+            doc = request._doc["$set"]
+            if doc["ts"] in self.refused:
+                errors.append({"index": i, "code": 121, "errmsg": "validation"})
+            elif doc["ts"] < 0:
+                errors.append({"index": i, "code": DUPLICATE_KEY, "errmsg": "dup"})
+            else:
+                self.docs[doc["query_id"], doc["ts"]] = doc
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+
+def write_all(col: FlakyCollection, seconds: list[int]) -> list:
+    async def run() -> list:
+        writer = AnomalyWriter(col, batch_size=len(seconds), max_wait=1, backoff=0)
+        writer.start()
+        try:
+            return await asyncio.gather(
+                *(writer.write({"query_id": 1, "ts": ts}) for ts in seconds),
+                return_exceptions=True,
+            )
+        finally:
+            await writer.close()
+
+    return asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_failed_batch_is_retried():
+    col = FlakyCollection(failures=2)
+
+    assert write_all(col, [0, 1, 2]) == [None, None, None]
+    assert sorted(col.docs) == [(1, 0), (1, 1), (1, 2)]
+
+
+def test_refused_document_fails_only_its_write():
+    col = FlakyCollection(refused={1})
+
+    results = write_all(col, [0, 1, 2])
+
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], WriteRejected)
+    assert sorted(col.docs) == [(1, 0), (1, 2)]
+
+
+def test_duplicate_key_race_counts_as_stored():
+    assert write_all(FlakyCollection(), [-1, 0]) == [None, None]
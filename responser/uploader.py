@@ -0,0 +1,74 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import urllib3
+from minio import Minio
+from minio.error import S3Error
+
+from metrics import STAGE_SECONDS, UPLOAD_RETRIES, UPLOADS_IN_FLIGHT
+
+RETRYABLE_CODES = {"InternalError", "RequestTimeout", "ServiceUnavailable", "SlowDown"}
+
+
+class Uploader:
+    """
+    Concurrent S3 uploads from asyncio code
+
+    Uploads run in a bounded thread pool, transient failures are retried with
+    exponential backoff, and the presigned link is computed in the same worker
+    right after the upload.
+    """
+
+    def __init__(
+        self,
+        s3: Minio,
+        bucket: str,
+        workers: int,
+        retries: int = 3,
+        backoff: float = 0.5,
+    ) -> None:
+        self._s3 = s3
+        self._bucket = bucket
+        self._retries = retries
+        self._backoff = backoff
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="s3")
+
+    @staticmethod
+    def is_transient(ex: Exception) -> bool:
+        if isinstance(ex, S3Error):
+            return ex.code in RETRYABLE_CODES
+        return isinstance(ex, (urllib3.exceptions.HTTPError, OSError))
+
+    def _put(self, name: str, data: bytes, content_type: str) -> str:
+        self._s3.put_object(
+            self._bucket,
+            name,
+            BytesIO(data),
+            length=len(data),
+            content_type=content_type,
+        )
+        return self._s3.presigned_get_object(self._bucket, name)
+
+    async def put(self, name: str, data: bytes, content_type: str) -> str:
+        """
+        Upload object and return presigned link to it
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(self._retries + 1):
+            try:
+                with UPLOADS_IN_FLIGHT.track_inprogress(), STAGE_SECONDS.labels(
+                    "s3_upload"
+                ).time():
+                    return await loop.run_in_executor(
+                        self._pool, self._put, name, data, content_type
+                    )
+            except Exception as ex:
+                if attempt == self._retries or not self.is_transient(ex):
+                    raise
+                print(f"Upload of {name} failed ({ex}), retrying")
+                UPLOAD_RETRIES.inc()
+                await asyncio.sleep(self._backoff * 2**attempt)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
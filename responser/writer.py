@@ -0,0 +1,189 @@
+import asyncio
+from contextlib import suppress
+
+import pymongo
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from metrics import STAGE_SECONDS, WRITE_BATCH, WRITE_BUFFER
+
+DUPLICATE_KEY = 11000
+INDEX_NAME = "query_id_ts"
+INDEX_ATTEMPTS = 3
+
+
+def remove_duplicates(col: Collection, batch_size: int = 10000) -> int:
+    """
+    Delete all but the last inserted document of every (query_id, ts)
+
+    Documents stored before the index was unique may repeat a second of a query.
+
+    Returns:
+        int: number of deleted documents
+    """
+    groups = col.aggregate(
+        [
+            {"$sort": {"_id": pymongo.ASCENDING}},
+            {
+                "$group": {
+                    "_id": {"query_id": "$query_id", "ts": "$ts"},
+                    "ids": {"$push": "$_id"},
+                }
+            },
+            {"$match": {"ids.1": {"$exists": True}}},
+        ],
+        allowDiskUse=True,
+    )
+    stale = [_id for group in groups for _id in group["ids"][:-1]]
+    for start in range(0, len(stale), batch_size):
+        col.delete_many({"_id": {"$in": stale[start : start + batch_size]}})
+    return len(stale)
+
+
+def ensure_indexes(col: Collection) -> None:
+    """
+    Create the unique (query_id, ts) index of anomalies
+
+    The responser owns the anomalies collection, the ML service only reads it
+    through this index. Duplicates left by older versions are removed first,
+    and a non-unique index of the same name is replaced.
+    """
+    index = col.index_information().get(INDEX_NAME)
+    if index is not None and index.get("unique"):
+        return
+
+    for attempt in range(1, INDEX_ATTEMPTS + 1):
+        removed = remove_duplicates(col)
+        if removed:
+            print(f"Removed {removed} duplicate anomalies")
+        if index is not None:
+            col.drop_index(INDEX_NAME)
+            index = None
+        try:
+            col.create_index(
+                [("query_id", pymongo.ASCENDING), ("ts", pymongo.ASCENDING)],
+                name=INDEX_NAME,
+                unique=True,
+            )
+            return
+        except DuplicateKeyError:
+            # a duplicate was written while the index was built
+            if attempt == INDEX_ATTEMPTS:
+                raise
+
+
+class WriteRejected(Exception):
+    """
+    Document refused by the database, writing it again can not succeed
+    """
+
+
+class AnomalyWriter:
+    """
+    Buffered idempotent writes of anomaly documents
+
+    Documents are upserted by (query_id, ts) with unordered bulk writes, so a
+    redelivered message replaces its document instead of adding a duplicate.
+    A batch is flushed when it holds `batch_size` documents or `max_wait`
+    seconds after it started, failed flushes are retried with the same batch.
+    `write` returns only when the document is stored, or raises WriteRejected
+    if the database refused that document.
+    """
+
+    def __init__(
+        self,
+        col: Collection,
+        batch_size: int,
+        max_wait: float,
+        backoff: float = 1.0,
+    ) -> None:
+        self._col = col
+        self._batch_size = batch_size
+        self._max_wait = max_wait
+        self._backoff = backoff
+        self._buffer: list[tuple[dict, asyncio.Future]] = []
+        self._pending = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+        if self._buffer:
+            await self._flush()
+
+    async def write(self, doc: dict) -> None:
+        stored = asyncio.get_running_loop().create_future()
+        self._buffer.append((doc, stored))
+        WRITE_BUFFER.set(len(self._buffer))
+        self._pending.set()
+        if len(self._buffer) >= self._batch_size:
+            self._full.set()
+        await stored
+
+    def _bulk_upsert(self, docs: list[dict]) -> dict[int, str]:
+        """
+        Returns:
+            dict[int, str]: positions of refused documents with the reason
+        """
+        requests = [
+            pymongo.UpdateOne(
+                {"query_id": doc["query_id"], "ts": doc["ts"]},
+                {"$set": doc},
+                upsert=True,
+            )
+            for doc in docs
+        ]
+        try:
+            self._col.bulk_write(requests, ordered=False)
+        except BulkWriteError as ex:
+            if ex.details.get("writeConcernErrors"):
+                raise
+            # concurrent upserts of the same key: one of them inserted the document
+            return {
+                error["index"]: error["errmsg"]
+                for error in ex.details.get("writeErrors", [])
+                if error["code"] != DUPLICATE_KEY
+            }
+        return {}
+
+    async def _flush(self) -> None:
+        batch, self._buffer = self._buffer, []
+        self._full.clear()
+        self._pending.clear()
+        try:
+            with STAGE_SECONDS.labels("mongo_write").time():
+                rejected = await asyncio.to_thread(
+                    self._bulk_upsert, [doc for doc, _ in batch]
+                )
+        except Exception:
+            self._buffer[:0] = batch
+            self._pending.set()
+            raise
+
+        WRITE_BATCH.observe(len(batch))
+        WRITE_BUFFER.set(len(self._buffer))
+        for i, (_, stored) in enumerate(batch):
+            if stored.done():
+                continue
+            if i in rejected:
+                stored.set_exception(WriteRejected(rejected[i]))
+            else:
+                stored.set_result(None)
+        print(f"Stored {len(batch) - len(rejected)} anomalies")
+
+    async def _run(self) -> None:
+        while True:
+            await self._pending.wait()
+            with suppress(TimeoutError):
+                await asyncio.wait_for(self._full.wait(), self._max_wait)
+            try:
+                await self._flush()
+            except Exception as ex:
+                print(f"Failed to store {len(self._buffer)} anomalies: {ex}")
+                await asyncio.sleep(self._backoff)